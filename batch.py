@@ -0,0 +1,201 @@
+import io
+import os
+import sys
+import glob
+import json
+import time
+import argparse
+import multiprocessing
+import contextlib
+from datetime import datetime
+from collections import OrderedDict
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from utils import get_v203_schema, xml_to_csv, csv_to_xml, xml_differencer, FINGERPRINT_MANIFEST_SUFFIX, SQLITE_STORE_BASENAME
+
+
+CSV_DIR_MARKER = "activities_static.csv"
+
+
+def expand_xml_paths(paths):
+    # Globs and directories to the XML files they name, in order and without repeats
+    xml_filenames = []
+    for path in paths:
+        for matched_path in sorted(glob.glob(path)) or [path]:
+            if os.path.isdir(matched_path):
+                candidates = sorted(glob.glob(os.path.join(matched_path, "*.xml")))
+            else:
+                candidates = [matched_path]
+            xml_filenames.extend(candidate for candidate in candidates if candidate not in xml_filenames)
+    return xml_filenames
+
+
+def expand_csv_dirs(paths, marker_basename=CSV_DIR_MARKER):
+    # Globs and directories to the CSV directories they name, a directory's subdirectories searched when it holds no CSVs itself
+    csv_dirs = []
+    for path in paths:
+        for matched_path in sorted(glob.glob(path)) or [path]:
+            if os.path.exists(os.path.join(matched_path, marker_basename)) or not os.path.isdir(matched_path):
+                candidates = [matched_path]
+            else:
+                candidates = sorted(os.path.dirname(marker) for marker in glob.glob(os.path.join(matched_path, "*", marker_basename)))
+            csv_dirs.extend(candidate for candidate in candidates if candidate not in csv_dirs)
+    return csv_dirs
+
+
+def past_filename_for(past_dir, current_xml_filename):
+    # The past publication with the current file's name, or the manifest a previous diff saved for it
+    past_basename = os.path.basename(current_xml_filename)
+    past_xml_filename = os.path.join(past_dir, past_basename)
+    past_manifest_filename = os.path.splitext(past_xml_filename)[0] + FINGERPRINT_MANIFEST_SUFFIX
+    if os.path.exists(past_xml_filename) or not os.path.exists(past_manifest_filename):
+        return past_xml_filename
+    return past_manifest_filename
+
+
+def output_paths_for(output_dir, output_filenames):
+    # Outputs moved into one directory; outputs that would share a name there are prefixed with their parent directory's name
+    basenames = [os.path.basename(output_filename) for output_filename in output_filenames]
+    output_paths = []
+    for output_filename, basename in zip(output_filenames, basenames):
+        if basenames.count(basename) > 1:
+            basename = "{}_{}".format(os.path.basename(os.path.dirname(os.path.abspath(output_filename))), basename)
+        output_paths.append(os.path.join(output_dir, basename))
+    return output_paths
+
+
+def run_job(job):
+    # One file in a worker, its printed feedback captured so concurrent jobs don't interleave
+    function_name, input_name, output_name, args, kwargs = job
+    function = {"xml_to_csv": xml_to_csv, "csv_to_xml": csv_to_xml, "xml_differencer": xml_differencer}[function_name]
+    log = io.StringIO()
+    start_time = time.perf_counter()
+    result = OrderedDict([("input", input_name), ("output", output_name), ("status", "ok"), ("summary", None)])
+    try:
+        with contextlib.redirect_stdout(log):
+            result["summary"] = function(*args, **kwargs)
+    except Exception as err:
+        result["status"] = "failed"
+        result["error"] = "{}: {}".format(type(err).__name__, err)
+    result["seconds"] = round(time.perf_counter() - start_time, 3)
+    result["log"] = log.getvalue().splitlines()
+    return result
+
+
+def build_jobs(arguments):
+    if arguments.command == "xml2csv":
+        jobs = []
+        xml_filenames = expand_xml_paths(arguments.paths)
+        csv_dirs = [os.path.splitext(xml_filename)[0] for xml_filename in xml_filenames]
+        if arguments.output_dir:
+            csv_dirs = output_paths_for(arguments.output_dir, csv_dirs)
+        for xml_filename, csv_dir in zip(xml_filenames, csv_dirs):
+            jobs.append(("xml_to_csv", xml_filename, csv_dir, (xml_filename, csv_dir),
+                         {"streaming": arguments.streaming, "update": arguments.update, "sqlite": arguments.sqlite,
+                          "validation_workers": arguments.validation_workers, "instrument": arguments.stages}))
+        return jobs
+    if arguments.command == "csv2xml":
+        jobs = []
+        csv_dirs = expand_csv_dirs(arguments.paths, SQLITE_STORE_BASENAME if arguments.sqlite else CSV_DIR_MARKER)
+        xml_filenames = [os.path.normpath(csv_dir) + "_converted.xml" for csv_dir in csv_dirs]
+        if arguments.output_dir:
+            xml_filenames = output_paths_for(arguments.output_dir, xml_filenames)
+        for csv_dir, xml_filename in zip(csv_dirs, xml_filenames):
+            jobs.append(("csv_to_xml", csv_dir, xml_filename, (csv_dir, xml_filename),
+                         {"workers": arguments.cast_workers, "incremental": arguments.incremental, "sqlite": arguments.sqlite,
+                          "validation_workers": arguments.validation_workers,
+                          "instrument": arguments.stages}))
+        return jobs
+    jobs = []
+    xml_filenames = expand_xml_paths(arguments.paths)
+    updated_xml_filenames = [os.path.splitext(xml_filename)[0] + "_updated.xml" for xml_filename in xml_filenames]
+    if arguments.output_dir:
+        updated_xml_filenames = output_paths_for(arguments.output_dir, updated_xml_filenames)
+    for xml_filename, updated_xml_filename in zip(xml_filenames, updated_xml_filenames):
+        past_filename = past_filename_for(arguments.past_dir, xml_filename)
+        jobs.append(("xml_differencer", xml_filename, updated_xml_filename,
+                     (past_filename, xml_filename, updated_xml_filename, arguments.ignore_datetimes, arguments.write_manifest, arguments.changeset),
+                     {"memory_budget_mb": arguments.memory_budget, "instrument": arguments.stages}))
+    return jobs
+
+
+def parse_arguments(argv):
+    parser = argparse.ArgumentParser(description="Convert or difference many IATI files at once, without the GUI.")
+    subparsers = parser.add_subparsers(dest="command")
+    subparsers.required = True
+
+    xml2csv_parser = subparsers.add_parser("xml2csv", help="Convert IATI XML files to CSV directories")
+    xml2csv_parser.add_argument("paths", nargs="+", help="XML files, globs, or directories of XML files")
+    xml2csv_parser.add_argument("--streaming", action="store_true", help="Melt activities as they are parsed, for very large files")
+    xml2csv_parser.add_argument("--update", action="store_true", help="Update existing CSVs rather than rewriting them")
+    xml2csv_parser.add_argument("--sqlite", action="store_true", help="Write an indexed SQLite store instead of CSVs")
+
+    csv2xml_parser = subparsers.add_parser("csv2xml", help="Convert CSV directories to IATI XML files")
+    csv2xml_parser.add_argument("paths", nargs="+", help="CSV directories, globs, or directories containing CSV directories")
+    csv2xml_parser.add_argument("--incremental", action="store_true", help="Only rebuild changed activities")
+    csv2xml_parser.add_argument("--sqlite", action="store_true", help="Read the SQLite store rather than the CSVs")
+    csv2xml_parser.add_argument("--cast-workers", type=int, default=1, metavar="N", help="Build each file's activities with N processes (default: 1)")
+
+    for subparser in [xml2csv_parser, csv2xml_parser]:
+        subparser.add_argument("--validation-workers", type=int, metavar="N",
+                               help="Validate in chunks of activities with N processes per file, rather than the whole file at once")
+
+    diff_parser = subparsers.add_parser("diff", help="Keep only the activities updated since a past publication")
+    diff_parser.add_argument("past_dir", help="Directory of past XML files, or their fingerprint manifests, with the same names")
+    diff_parser.add_argument("paths", nargs="+", help="Current XML files, globs, or directories of XML files")
+    diff_parser.add_argument("--ignore-datetimes", action="store_true", help="Ignore generated and last updated datetimes")
+    diff_parser.add_argument("--write-manifest", action="store_true", help="Save a fingerprint manifest beside each updated file")
+    diff_parser.add_argument("--changeset", action="store_true", help="Save the changed fields of each file as a CSV beside it")
+    diff_parser.add_argument("--memory-budget", type=float, metavar="MB", help="Stream both files, sorting on disk with this many MB shared between the sort buffers, for files larger than memory")
+
+    for subparser in [xml2csv_parser, csv2xml_parser, diff_parser]:
+        subparser.add_argument("--output-dir", help="Write outputs here instead of beside their inputs")
+        subparser.add_argument("--workers", type=int, default=os.cpu_count() or 1, help="Files processed at once (default: one per CPU)")
+        subparser.add_argument("--report", default="batch_report.json", help="JSON report of every file (default: batch_report.json)")
+        subparser.add_argument("--stages", action="store_true", help="Time each stage of every file, in its log and the report")
+    return parser.parse_args(argv)
+
+
+def main(argv):
+    arguments = parse_arguments(argv)
+    if arguments.output_dir and not os.path.exists(arguments.output_dir):
+        os.makedirs(arguments.output_dir)
+    jobs = build_jobs(arguments)
+    output_names = [os.path.normcase(os.path.abspath(job[2])) for job in jobs]
+    repeated_output_names = sorted(set(output_name for output_name in output_names if output_names.count(output_name) > 1))
+    if repeated_output_names:  # Concurrent jobs would overwrite each other's output
+        print("More than one input would be written to: {}".format(", ".join(repeated_output_names)))
+        return 1
+    workers = max(1, min(arguments.workers, len(jobs)))
+    print("{} {} files with {} workers".format(arguments.command, len(jobs), workers))
+
+    started = datetime.now().isoformat()
+    start_time = time.perf_counter()
+    results = {}
+    # Each worker loads the schema once, then reuses it for every file it is given
+    with ProcessPoolExecutor(max_workers=workers, initializer=get_v203_schema) as executor:
+        futures = {executor.submit(run_job, job): job_index for job_index, job in enumerate(jobs)}
+        for future in as_completed(futures):
+            result = future.result()
+            results[futures[future]] = result
+            print("{}: {} in {:.2f}s{}".format(result["input"], result["status"], result["seconds"], ", " + result["error"] if "error" in result else ""))
+
+    file_results = [results[job_index] for job_index in range(len(jobs))]
+    failed_count = len([result for result in file_results if result["status"] != "ok"])
+    report = OrderedDict([
+        ("command", arguments.command),
+        ("workers", workers),
+        ("started", started),
+        ("seconds", round(time.perf_counter() - start_time, 3)),
+        ("files", len(file_results)),
+        ("failed", failed_count),
+        ("results", file_results),
+    ])
+    with open(arguments.report, "w") as report_file:
+        json.dump(report, report_file, indent=2)
+    print("{} of {} files failed. Report saved as '{}'.".format(failed_count, len(file_results), arguments.report))
+    return 1 if failed_count else 0
+
+
+if __name__ == "__main__":
+    multiprocessing.freeze_support()
+    sys.exit(main(sys.argv[1:]))
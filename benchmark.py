@@ -0,0 +1,274 @@
+import os
+import sys
+import copy
+import json
+import time
+import tempfile
+import argparse
+import platform
+import subprocess
+from datetime import datetime
+from lxml import etree
+from collections import OrderedDict
+from concurrent.futures import ProcessPoolExecutor
+from utils import xml_differencer, normalise_element, melt_iati, melted_to_csv, open_csv_dir, cast_iati, xml_to_csv, csv_to_xml, peak_rss_mb
+from synthetic import generate_publications
+
+
+PAST_XML_FILENAME = os.path.join("test_data", "DIPR IATI data February 2018.xml")
+CURRENT_XML_FILENAME = os.path.join("test_data", "DIPR IATI data June 2019.xml")
+ENTRY_POINTS = ["xml2csv", "csv2xml", "diff"]
+HEAVY_MODULES = ["pandas", "lxml", "iati", "utils"]
+STARTUP_BUDGET_SECONDS = 0.5
+STARTUP_SCRIPT = """
+import sys, time
+start_time = time.perf_counter()
+import {0}
+print(time.perf_counter() - start_time)
+print(" ".join(module_name for module_name in {1!r} if module_name in sys.modules))
+"""
+SCALING_SIZES = [1000, 10000]
+SCALING_STAGES = ["melt_iati", "cast_iati", "open_csv_dir", "xml_to_csv", "csv_to_xml", "xml_differencer"]
+SCALING_RESULTS_FILENAME = "benchmark_results.json"
+
+
+def elements_equal(e1, e2):
+    if e1.tag != e2.tag:
+        return False
+    if e1.text != e2.text:
+        return False
+    if e1.tail != e2.tail:
+        return False
+    if e1.attrib != e2.attrib:
+        return False
+    if len(e1) != len(e2):
+        return False
+    if not all(elements_equal(c1, c2) for c1, c2 in zip(e1, e2)):
+        return False
+    return True
+
+
+def xpath_scan_differencer(past_xml_filename, current_xml_filename, updated_xml_filename):
+    # The list membership and per-identifier XPath implementation xml_differencer replaced, kept for comparison
+    past_root = etree.parse(past_xml_filename).getroot()
+    current_root = etree.parse(current_xml_filename).getroot()
+
+    past_ids = [iati_id.text for iati_id in past_root.xpath("//iati-identifier")]
+    current_ids = [iati_id.text for iati_id in current_root.xpath("//iati-identifier")]
+    new_ids = [current_id for current_id in current_ids if current_id not in past_ids]
+    removed_ids = [past_id for past_id in past_ids if past_id not in current_ids]
+    common_ids = [past_id for past_id in past_ids if past_id in current_ids]
+    print("{} new activities, {} common activities, {} removed activities".format(len(new_ids), len(common_ids), len(removed_ids)))
+    for common_id in common_ids:
+        past_elem = past_root.xpath("//iati-activity[iati-identifier/text()='{}']".format(common_id))[0]
+        current_elem = current_root.xpath("//iati-activity[iati-identifier/text()='{}']".format(common_id))[0]
+        if elements_equal(past_elem, current_elem):
+            current_elem.getparent().remove(current_elem)
+
+    doc = etree.ElementTree(current_root)
+    with open(updated_xml_filename, "wb") as xmlfile:
+        doc.write(xmlfile, encoding="utf-8", pretty_print=True)
+
+
+def scale_xml(xml_filename, scaled_xml_filename, copies):
+    # Repeat every activity under suffixed identifiers, so the small test files can stand in for large ones
+    tree = etree.parse(xml_filename)
+    root = tree.getroot()
+    activities = list(root.iter("iati-activity"))
+    for copy_index in range(1, copies):
+        for activity in activities:
+            activity_copy = copy.deepcopy(activity)
+            iati_id = activity_copy.find("iati-identifier")
+            if iati_id is not None and iati_id.text is not None:
+                iati_id.text = "{}-{}".format(iati_id.text, copy_index)
+            root.append(activity_copy)
+    tree.write(scaled_xml_filename, encoding="utf-8")
+
+
+def melt_to_csv_dir(xml_filename, csv_dir):
+    # xml_to_csv without the input validation, which would dominate at these sizes
+    os.makedirs(csv_dir)
+    root = etree.parse(xml_filename, etree.XMLParser(remove_blank_text=True)).getroot()
+    normalise_element(root)
+    for melted_list, csv_basename in zip(melt_iati(root), ["activities_static.csv", "activities_additions.csv", "transactions.csv", "budgets.csv"]):
+        melted_to_csv(melted_list, os.path.join(csv_dir, csv_basename))
+
+
+def timed(function, *args, **kwargs):
+    # Seconds taken by one quiet call
+    stdout = sys.stdout
+    sys.stdout = open(os.devnull, "w")
+    try:
+        start_time = time.perf_counter()
+        function(*args, **kwargs)
+        return time.perf_counter() - start_time
+    finally:
+        sys.stdout.close()
+        sys.stdout = stdout
+
+
+def benchmark_differencer(copies_list=(1, 5, 10)):
+    with tempfile.TemporaryDirectory() as temp_dir:
+        for copies in copies_list:
+            past_xml_filename = os.path.join(temp_dir, "past.xml")
+            current_xml_filename = os.path.join(temp_dir, "current.xml")
+            scale_xml(PAST_XML_FILENAME, past_xml_filename, copies)
+            scale_xml(CURRENT_XML_FILENAME, current_xml_filename, copies)
+            activity_count = len(etree.parse(current_xml_filename).getroot())
+
+            xpath_scan_filename = os.path.join(temp_dir, "xpath_scan.xml")
+            indexed_filename = os.path.join(temp_dir, "indexed.xml")
+            xpath_scan_seconds = timed(xpath_scan_differencer, past_xml_filename, current_xml_filename, xpath_scan_filename)
+            indexed_seconds = timed(xml_differencer, past_xml_filename, current_xml_filename, indexed_filename)
+            with open(xpath_scan_filename, "rb") as xpath_scan_file, open(indexed_filename, "rb") as indexed_file:
+                identical = xpath_scan_file.read() == indexed_file.read()
+            print("xml_differencer, {} activities: xpath scan {:.3f}s, indexed {:.3f}s ({:.1f}x), identical output: {}".format(
+                activity_count, xpath_scan_seconds, indexed_seconds, xpath_scan_seconds / indexed_seconds, identical))
+
+
+def benchmark_cast_workers(copies=20, workers_list=(1, 2, os.cpu_count())):
+    with tempfile.TemporaryDirectory() as temp_dir:
+        xml_filename = os.path.join(temp_dir, "current.xml")
+        csv_dir = os.path.join(temp_dir, "current")
+        scale_xml(CURRENT_XML_FILENAME, xml_filename, copies)
+        melt_to_csv_dir(xml_filename, csv_dir)
+        activities, transactions, budgets = open_csv_dir(csv_dir)
+        if (os.cpu_count() or 1) < 2:  # Workers then only share one core, so this measures the pool's overhead, not a speedup
+            print("cast_iati: only {} CPU, so extra workers can't be faster here".format(os.cpu_count() or 1))
+        serial_seconds = None
+        for workers in sorted(set(workers_list)):
+            workers_seconds = timed(cast_iati, activities, transactions, budgets, workers=workers)
+            serial_seconds = serial_seconds or workers_seconds
+            print("cast_iati, {} activities, {} workers: {:.3f}s ({:.1f}x)".format(
+                len(activities), workers, workers_seconds, serial_seconds / workers_seconds))
+
+
+def benchmark_startup(budget_seconds=STARTUP_BUDGET_SECONDS, repeats=3):
+    # Import time of each GUI entry point in a fresh interpreter, which must stay in budget and free of heavy modules
+    within_budget = True
+    for entry_point in ENTRY_POINTS:
+        startup_times = []
+        for _ in range(repeats):
+            startup_output = subprocess.check_output([sys.executable, "-c", STARTUP_SCRIPT.format(entry_point, HEAVY_MODULES)], cwd=os.path.dirname(os.path.abspath(__file__)), universal_newlines=True)
+            startup_seconds, heavy_modules = (startup_output.split("\n") + [""])[:2]
+            startup_times.append(float(startup_seconds))
+        startup_seconds = min(startup_times)
+        entry_point_ok = startup_seconds <= budget_seconds and not heavy_modules
+        within_budget = within_budget and entry_point_ok
+        print("{} startup: {:.3f}s (budget {:.3f}s){}{}".format(
+            entry_point, startup_seconds, budget_seconds, ", eagerly imports " + heavy_modules if heavy_modules else "", "" if entry_point_ok else " FAILED"))
+    return within_budget
+
+
+def measure_stage(stage_name, work_dir):
+    # Runs in a fresh worker process, so its peak memory belongs to this stage and its inputs alone
+    past_xml_filename = os.path.join(work_dir, "past.xml")
+    current_xml_filename = os.path.join(work_dir, "current.xml")
+    csv_dir = os.path.join(work_dir, "current")
+    output_dir = tempfile.mkdtemp(dir=work_dir)
+    if stage_name == "melt_iati":
+        root = etree.parse(current_xml_filename, etree.XMLParser(remove_blank_text=True)).getroot()
+        normalise_element(root)
+        stage_args = (melt_iati, root)
+    elif stage_name == "cast_iati":
+        stage_args = (cast_iati,) + open_csv_dir(csv_dir)
+    elif stage_name == "open_csv_dir":
+        stage_args = (open_csv_dir, csv_dir)
+    elif stage_name == "xml_to_csv":
+        stage_args = (xml_to_csv, current_xml_filename, output_dir)
+    elif stage_name == "csv_to_xml":
+        stage_args = (csv_to_xml, csv_dir, os.path.join(output_dir, "converted.xml"))
+    else:
+        stage_args = (xml_differencer, past_xml_filename, current_xml_filename, os.path.join(output_dir, "updated.xml"))
+
+    setup_rss_mb = peak_rss_mb()
+    cpu_start_time = time.process_time()
+    seconds = timed(*stage_args)
+    return OrderedDict([
+        ("seconds", round(seconds, 3)),
+        ("cpu-seconds", round(time.process_time() - cpu_start_time, 3)),
+        ("setup-peak-rss-mb", setup_rss_mb),
+        ("peak-rss-mb", peak_rss_mb()),
+    ])
+
+
+def benchmark_scaling(sizes=SCALING_SIZES, transactions=18, budgets=4, results=0, stages=SCALING_STAGES,
+                      results_filename=SCALING_RESULTS_FILENAME, baseline_filename=None):
+    # Time and peak memory of each pipeline stage on synthetic publications of each size, saved as JSON to compare between runs
+    baseline = {}
+    if baseline_filename:
+        with open(baseline_filename) as baseline_file:
+            for baseline_result in json.load(baseline_file)["results"]:
+                baseline[(baseline_result["stage"], baseline_result["activities"])] = baseline_result
+
+    stage_results = []
+    for size in sizes:
+        with tempfile.TemporaryDirectory() as work_dir:
+            generate_publications(os.path.join(work_dir, "past.xml"), os.path.join(work_dir, "current.xml"), size, transactions, budgets, results)
+            melt_to_csv_dir(os.path.join(work_dir, "current.xml"), os.path.join(work_dir, "current"))
+            for stage_name in stages:
+                with ProcessPoolExecutor(max_workers=1) as executor:
+                    measurement = executor.submit(measure_stage, stage_name, work_dir).result()
+                stage_result = OrderedDict([("stage", stage_name), ("activities", size)])
+                stage_result.update(measurement)
+                stage_results.append(stage_result)
+
+                baseline_result = baseline.get((stage_name, size))
+                comparison = ", baseline {:.3f}s ({:+.0%})".format(
+                    baseline_result["seconds"], measurement["seconds"] / baseline_result["seconds"] - 1) if baseline_result else ""
+                print("{}, {} activities: {:.3f}s, peak {} MB{}".format(stage_name, size, measurement["seconds"], measurement["peak-rss-mb"], comparison))
+
+    with open(results_filename, "w") as results_file:
+        json.dump(OrderedDict([
+            ("started", datetime.now().isoformat()),
+            ("python", platform.python_version()),
+            ("platform", platform.platform()),
+            ("transactions-per-activity", transactions),
+            ("budgets-per-activity", budgets),
+            ("results-per-activity", results),
+            ("results", stage_results),
+        ]), results_file, indent=2)
+    print("Results saved as '{}'".format(results_filename))
+
+
+BENCHMARKS = OrderedDict([
+    ("startup", benchmark_startup),
+    ("differencer", benchmark_differencer),
+    ("cast", benchmark_cast_workers),
+    ("scaling", benchmark_scaling),
+])
+
+
+def parse_arguments(argv):
+    parser = argparse.ArgumentParser(description="Benchmark the IATI editor tools.")
+    parser.add_argument("benchmarks", nargs="*", help="Benchmarks to run, from {} (default: all)".format(", ".join(BENCHMARKS.keys())))
+    parser.add_argument("--sizes", default=",".join(str(size) for size in SCALING_SIZES), help="Activity counts for the scaling benchmark, comma separated")
+    parser.add_argument("--transactions", type=int, default=18, help="Transactions per synthetic activity")
+    parser.add_argument("--budgets", type=int, default=4, help="Budgets per synthetic activity")
+    parser.add_argument("--results", type=int, default=0, help="Results per synthetic activity")
+    parser.add_argument("--stages", default=",".join(SCALING_STAGES), help="Stages for the scaling benchmark, comma separated")
+    parser.add_argument("--output", default=SCALING_RESULTS_FILENAME, help="JSON file for scaling results")
+    parser.add_argument("--baseline", help="Scaling results of an earlier run to compare against")
+    arguments = parser.parse_args(argv)
+    for benchmark_name in arguments.benchmarks:
+        if benchmark_name not in BENCHMARKS:
+            parser.error("unknown benchmark '{}'".format(benchmark_name))
+    return arguments
+
+
+if __name__ == "__main__":
+    arguments = parse_arguments(sys.argv[1:])
+    scaling_kwargs = {
+        "sizes": [int(size) for size in arguments.sizes.split(",")],
+        "transactions": arguments.transactions,
+        "budgets": arguments.budgets,
+        "results": arguments.results,
+        "stages": arguments.stages.split(","),
+        "results_filename": arguments.output,
+        "baseline_filename": arguments.baseline,
+    }
+    failed = False
+    for benchmark_name in arguments.benchmarks or BENCHMARKS.keys():
+        benchmark_kwargs = scaling_kwargs if benchmark_name == "scaling" else {}
+        failed = BENCHMARKS[benchmark_name](**benchmark_kwargs) is False or failed
+    sys.exit(1 if failed else 0)
@@ -1,26 +1,28 @@
+import os
 import sys
-from utils import csv_to_xml
-from tkinter import Label, Entry, Button, Tk, filedialog, END, Text, W, E, N, S
+import threading
+import importlib
+import multiprocessing
+from gui import JobRunner
+from tkinter import Label, Entry, Button, Checkbutton, IntVar, Tk, filedialog, END, Text, W, E, N, S
 
 
-class StdoutRedirector(object):
-    def __init__(self, text_widget):
-        self.text_space = text_widget
+PRELOAD_DELAY_MS = 200
 
-    def write(self, string):
-        self.text_space.configure(state='normal')
-        self.text_space.insert('end', string)
-        self.text_space.see('end')
-        self.text_space.configure(state='disabled')
 
-    def flush(self):
-        pass
+def preload():
+    # Heavy modules (pandas, lxml, iati) are imported off the main thread once the window is up
+    importlib.import_module("utils")
 
 
 class Window:
     def __init__(self, master):
         self.input = None
         self.output = None
+        self.incremental = IntVar()
+        self.instrument = IntVar()
+        self.sqlite = IntVar()
+        self.all_cpus = IntVar()
         Label(root, text="Input directory").grid(row=1, column=0, sticky=W)
         Label(root, text="Output XML (optional)").grid(row=2, column=0, sticky=W)
         self.bari = Entry(master, state='disabled')
@@ -28,6 +30,11 @@ class Window:
         self.baro = Entry(master, state='disabled')
         self.baro.grid(row=2, column=1, sticky=W + E)
 
+        Checkbutton(root, text="Only rebuild changed activities", variable=self.incremental).grid(row=3, column=0, sticky=W)
+        Checkbutton(root, text="Show stage timings", variable=self.instrument).grid(row=3, column=1, sticky=W)
+        Checkbutton(root, text="SQLite store", variable=self.sqlite).grid(row=3, column=2, sticky=W)
+        Checkbutton(root, text="Build with every CPU", variable=self.all_cpus).grid(row=4, column=0, sticky=W)
+
         # Buttons
         self.cbutton = Button(root, text="Generate XML", command=self.process)
         self.cbutton.grid(row=3, column=3, sticky=E)
@@ -36,10 +43,12 @@ class Window:
         self.obutton = Button(root, text="Browse", command=self.browseoutput)
         self.obutton.grid(row=2, column=3, sticky=E)
 
+        self.kbutton = Button(root, text="Cancel")
+        self.kbutton.grid(row=5, column=3, sticky=E)
+
         self.text_box = Text(root, wrap='word', height=10, state='disabled')
-        self.text_box.grid(column=0, row=4, padx=5, pady=5, columnspan=4, sticky=W + E + N + S)
-        sys.stdout = StdoutRedirector(self.text_box)
-        sys.stderr = StdoutRedirector(self.text_box)
+        self.text_box.grid(column=0, row=6, padx=5, pady=5, columnspan=4, sticky=W + E + N + S)
+        self.runner = JobRunner(root, self.text_box, self.cbutton, self.kbutton, row=5)
 
     def browseinput(self):
         Tk().withdraw()
@@ -59,7 +68,14 @@ class Window:
 
     def process(self):
         if self.input:
-            csv_to_xml(self.input, self.output)
+            csv_dir, xml_filename = self.input, self.output
+            incremental, sqlite, instrument = bool(self.incremental.get()), bool(self.sqlite.get()), bool(self.instrument.get())
+            workers = (os.cpu_count() or 1) if self.all_cpus.get() else 1
+
+            def convert():
+                from utils import csv_to_xml
+                csv_to_xml(csv_dir, xml_filename, workers, incremental=incremental, sqlite=sqlite, instrument=instrument)
+            self.runner.start(convert)
         else:
             print("Error: Please select one input directory.")
 
@@ -69,8 +85,11 @@ def on_closing():
     sys.exit(0)
 
 
-root = Tk()
-root.title("DevInit IATI CSV to XML tool")
-root.protocol("WM_DELETE_WINDOW", on_closing)
-window = Window(root)
-root.mainloop()
+if __name__ == "__main__":
+    multiprocessing.freeze_support()  # Worker processes of a frozen exe must not open another window
+    root = Tk()
+    root.title("DevInit IATI CSV to XML tool")
+    root.protocol("WM_DELETE_WINDOW", on_closing)
+    window = Window(root)
+    root.after(PRELOAD_DELAY_MS, lambda: threading.Thread(target=preload, daemon=True).start())
+    root.mainloop()
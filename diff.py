@@ -1,20 +1,18 @@
 import sys
-from utils import xml_differencer
-from tkinter import Label, Entry, Button, Tk, filedialog, END, Text, W, E, N, S
+import threading
+import importlib
+import multiprocessing
+from gui import JobRunner
+from tkinter import Label, Entry, Button, Checkbutton, IntVar, Tk, filedialog, END, Text, W, E, N, S
 
 
-class StdoutRedirector(object):
-    def __init__(self, text_widget):
-        self.text_space = text_widget
+PRELOAD_DELAY_MS = 200
+DIFF_MEMORY_BUDGET_MB = 256  # As utils, which isn't imported until the window is up
 
-    def write(self, string):
-        self.text_space.configure(state='normal')
-        self.text_space.insert('end', string)
-        self.text_space.see('end')
-        self.text_space.configure(state='disabled')
 
-    def flush(self):
-        pass
+def preload():
+    # Heavy modules (pandas, lxml, iati) are imported off the main thread once the window is up
+    importlib.import_module("utils")
 
 
 class Window:
@@ -22,7 +20,12 @@ class Window:
         self.input1 = None
         self.input2 = None
         self.output = None
-        Label(root, text="Past XML file").grid(row=1, column=0, sticky=W)
+        self.ignore_datetimes = IntVar()
+        self.write_manifest = IntVar()
+        self.write_changeset = IntVar()
+        self.low_memory = IntVar()
+        self.instrument = IntVar()
+        Label(root, text="Past XML file or manifest").grid(row=1, column=0, sticky=W)
         Label(root, text="Current XML file").grid(row=2, column=0, sticky=W)
         Label(root, text="Output XML file").grid(row=3, column=0, sticky=W)
         self.bari1 = Entry(master, state='disabled')
@@ -32,6 +35,12 @@ class Window:
         self.baro = Entry(master, state='disabled')
         self.baro.grid(row=3, column=1, sticky=W + E)
 
+        Checkbutton(root, text="Ignore datetimes", variable=self.ignore_datetimes).grid(row=4, column=0, sticky=W)
+        Checkbutton(root, text="Save fingerprint manifest", variable=self.write_manifest).grid(row=4, column=1, sticky=W)
+        Checkbutton(root, text="Show stage timings", variable=self.instrument).grid(row=4, column=2, sticky=W)
+        Checkbutton(root, text="Save changed fields as CSV", variable=self.write_changeset).grid(row=5, column=0, sticky=W)
+        Checkbutton(root, text="Low memory, for very large files", variable=self.low_memory).grid(row=5, column=1, sticky=W)
+
         # Buttons
         self.cbutton = Button(root, text="Generate difference", command=self.process)
         self.cbutton.grid(row=4, column=3, sticky=E)
@@ -42,14 +51,16 @@ class Window:
         self.obutton = Button(root, text="Browse", command=self.browseoutput)
         self.obutton.grid(row=3, column=3, sticky=E)
 
+        self.kbutton = Button(root, text="Cancel")
+        self.kbutton.grid(row=6, column=3, sticky=E)
+
         self.text_box = Text(root, wrap='word', height=10, state='disabled')
-        self.text_box.grid(column=0, row=5, padx=5, pady=5, columnspan=4, sticky=W + E + N + S)
-        sys.stdout = StdoutRedirector(self.text_box)
-        sys.stderr = StdoutRedirector(self.text_box)
+        self.text_box.grid(column=0, row=7, padx=5, pady=5, columnspan=4, sticky=W + E + N + S)
+        self.runner = JobRunner(root, self.text_box, self.cbutton, self.kbutton, row=6)
 
     def browseinput1(self):
         Tk().withdraw()
-        self.input1 = filedialog.askopenfilename(filetypes=[('XML files', '.xml'), ('All files', '.*')])
+        self.input1 = filedialog.askopenfilename(filetypes=[('XML files', '.xml'), ('Fingerprint manifests', '.json'), ('All files', '.*')])
         self.bari1.configure(state='normal')
         self.bari1.delete(0, END)
         self.bari1.insert(0, self.input1)
@@ -73,9 +84,18 @@ class Window:
 
     def process(self):
         if self.input1 and self.input2 and self.output:
-            xml_differencer(self.input1, self.input2, self.output)
+            past_xml_filename, current_xml_filename, updated_xml_filename = self.input1, self.input2, self.output
+            ignore_datetimes, write_manifest = bool(self.ignore_datetimes.get()), bool(self.write_manifest.get())
+            write_changeset = bool(self.write_changeset.get())
+            memory_budget_mb = DIFF_MEMORY_BUDGET_MB if self.low_memory.get() else None
+            instrument = bool(self.instrument.get())
+
+            def difference():
+                from utils import xml_differencer
+                xml_differencer(past_xml_filename, current_xml_filename, updated_xml_filename, ignore_datetimes, write_manifest, write_changeset, memory_budget_mb, instrument=instrument)
+            self.runner.start(difference)
         else:
-            print("Error: Please select one past XML file, one current XML file, and an output filename.")
+            print("Error: Please select one past XML file or manifest, one current XML file, and an output filename.")
 
 
 def on_closing():
@@ -83,8 +103,11 @@ def on_closing():
     sys.exit(0)
 
 
-root = Tk()
-root.title("DevInit IATI XML Differencer")
-root.protocol("WM_DELETE_WINDOW", on_closing)
-window = Window(root)
-root.mainloop()
+if __name__ == "__main__":
+    multiprocessing.freeze_support()
+    root = Tk()
+    root.title("DevInit IATI XML Differencer")
+    root.protocol("WM_DELETE_WINDOW", on_closing)
+    window = Window(root)
+    root.after(PRELOAD_DELAY_MS, lambda: threading.Thread(target=preload, daemon=True).start())
+    root.mainloop()
@@ -0,0 +1,114 @@
+import sys
+import queue
+import threading
+import traceback
+from tkinter import Label, W
+from tkinter.ttk import Progressbar
+
+
+POLL_INTERVAL_MS = 100
+
+
+class QueueRedirector(object):
+    # print() from any thread lands on a queue, which the Tk thread drains in batches
+    def __init__(self, log_queue):
+        self.log_queue = log_queue
+
+    def write(self, string):
+        self.log_queue.put(string)
+
+    def flush(self):
+        pass
+
+
+class JobRunner(object):
+    # Runs one conversion at a time off the Tk thread, showing its output and progress in the window. The progress
+    # label and bar take the given row, beside the cancel button in its last column
+    def __init__(self, master, text_box, run_button, cancel_button, row):
+        self.master = master
+        self.text_box = text_box
+        self.run_button = run_button
+        self.cancel_button = cancel_button
+        self.progress_label = Label(master, text="")
+        self.progress_label.grid(row=row, column=0, sticky=W)
+        self.progress_bar = Progressbar(master, mode="determinate")
+        self.progress_bar.grid(row=row, column=1, columnspan=2, padx=5, sticky="we")
+        self.cancel_button.configure(state="disabled", command=self.cancel)
+
+        self.log_queue = queue.Queue()
+        self.cancel_event = threading.Event()
+        self.thread = None
+        self.progress = None
+        sys.stdout = QueueRedirector(self.log_queue)
+        sys.stderr = QueueRedirector(self.log_queue)
+        self.master.after(POLL_INTERVAL_MS, self.poll)
+
+    def start(self, job):
+        if self.thread is not None:
+            return
+        self.cancel_event.clear()
+        self.progress = None
+        self.run_button.configure(state="disabled")
+        self.cancel_button.configure(state="normal")
+        self.thread = threading.Thread(target=self.run, args=(job,), daemon=True)
+        self.thread.start()
+
+    def run(self, job):
+        import utils
+        utils.progress_handler = self.report_progress
+        try:
+            job()
+        except utils.ConversionCancelled:
+            print("Cancelled.")
+        except Exception:
+            traceback.print_exc()
+        finally:
+            utils.progress_handler = None
+
+    def report_progress(self, stage_name, done, total):
+        # Called on the worker thread, so it only records the latest figures for poll to show
+        self.progress = (stage_name, done, total)
+        if self.cancel_event.is_set():
+            import utils
+            raise utils.ConversionCancelled()
+
+    def cancel(self):
+        if self.thread is not None and not self.cancel_event.is_set():
+            print("Cancelling...")
+            self.cancel_event.set()
+
+    def poll(self):
+        log_strings = []
+        while True:
+            try:
+                log_strings.append(self.log_queue.get_nowait())
+            except queue.Empty:
+                break
+        if log_strings:
+            self.text_box.configure(state="normal")
+            self.text_box.insert("end", "".join(log_strings))
+            self.text_box.see("end")
+            self.text_box.configure(state="disabled")
+
+        progress = self.progress
+        if progress is not None:
+            stage_name, done, total = progress
+            if total:
+                self.progress_bar.stop()
+                self.progress_bar.configure(mode="determinate", maximum=total, value=done)
+                self.progress_label.configure(text="{} ({} of {})".format(stage_name, done, total))
+            else:  # Nothing to count against, so just show it is working
+                if str(self.progress_bar["mode"]) != "indeterminate":
+                    self.progress_bar.configure(mode="indeterminate")
+                    self.progress_bar.start()
+                self.progress_label.configure(text="{} ({})".format(stage_name, done) if done else stage_name)
+
+        if self.thread is not None and not self.thread.is_alive():
+            self.thread = None
+            self.progress = None
+            self.progress_bar.stop()
+            self.progress_bar.configure(mode="determinate", value=0)
+            self.progress_label.configure(text="")
+            self.run_button.configure(state="normal")
+            self.cancel_button.configure(state="disabled")
+        self.master.after(POLL_INTERVAL_MS, self.poll)
@@ -0,0 +1,118 @@
+import sys
+import random
+import argparse
+from datetime import date, timedelta
+from lxml import etree
+
+
+REPORTING_ORG_REF = "GB-COH-06368740"
+REPORTING_ORG_NAME = "Development Initiatives Poverty Research"
+IDENTIFIER_FORMAT = REPORTING_ORG_REF + "-S{:07d}"
+GENERATED_DATETIME = "2019-06-30T00:00:00"
+RECIPIENT_COUNTRIES = ["GB", "KE", "UG", "NP", "ET", "TZ"]
+SECTORS = ["91010", "15110", "12220", "11220", "43010", "15170"]
+PROVIDER_ORGS = [("GB-GOV-1", "DFID"), ("XM-DAC-41122", "UNICEF"), ("US-EIN-562618866", "Bill & Melinda Gates Foundation")]
+TRANSACTION_TYPES = ["1", "2", "3", "4"]
+ACTIVITY_WORDS = ["Data", "poverty", "research", "training", "communications", "budget", "analysis", "programme", "support", "project"]
+START_DATE = date(2015, 1, 1)
+
+
+def narrative_element(tag, text, **attrib):
+    element = etree.Element(tag, **attrib)
+    etree.SubElement(element, "narrative").text = text
+    return element
+
+
+def iso_date(day):
+    return day.isoformat()
+
+
+def synthetic_activity(activity_index, transactions=18, budgets=4, results=0, revised=False):
+    # One valid 2.03 activity shaped like the DIPR publications, its contents fixed by its index
+    rng = random.Random(activity_index)
+    iati_identifier = IDENTIFIER_FORMAT.format(activity_index)
+    start_date = START_DATE + timedelta(days=rng.randrange(730))
+    activity = etree.Element("iati-activity", {"default-currency": "GBP", "last-updated-datetime": GENERATED_DATETIME})
+    etree.SubElement(activity, "iati-identifier").text = iati_identifier
+    activity.append(narrative_element("reporting-org", REPORTING_ORG_NAME, ref=REPORTING_ORG_REF, type="21"))
+    title = " ".join(rng.choice(ACTIVITY_WORDS) for _ in range(4)).capitalize()
+    activity.append(narrative_element("title", title + " (revised)" if revised else title))
+    activity.append(narrative_element("description", "Synthetic activity {} for benchmarking".format(activity_index)))
+    participating_org = narrative_element("participating-org", REPORTING_ORG_NAME, ref=REPORTING_ORG_REF, role="4", type="21")
+    participating_org.set("activity-id", iati_identifier)
+    activity.append(participating_org)
+    etree.SubElement(activity, "activity-status", code="2")
+    etree.SubElement(activity, "activity-date", {"iso-date": iso_date(start_date), "type": "2"})
+    etree.SubElement(activity, "recipient-country", code=rng.choice(RECIPIENT_COUNTRIES), percentage="100")
+    etree.SubElement(activity, "sector", vocabulary="1", percentage="100", code=rng.choice(SECTORS))
+
+    for budget_index in range(budgets):  # Consecutive quarters from the start date
+        period_start = start_date + timedelta(days=91 * budget_index)
+        period_end = period_start + timedelta(days=90)
+        budget = etree.SubElement(activity, "budget", type="1", status="1")
+        etree.SubElement(budget, "period-start", {"iso-date": iso_date(period_start)})
+        etree.SubElement(budget, "period-end", {"iso-date": iso_date(period_end)})
+        etree.SubElement(budget, "value", {"value-date": iso_date(period_start)}).text = "{:.2f}".format(rng.uniform(1000, 50000))
+
+    for transaction_index in range(transactions):
+        transaction_date = start_date + timedelta(days=rng.randrange(365))
+        provider_ref, provider_name = rng.choice(PROVIDER_ORGS)
+        transaction = etree.SubElement(activity, "transaction")
+        etree.SubElement(transaction, "transaction-type", code=rng.choice(TRANSACTION_TYPES))
+        etree.SubElement(transaction, "transaction-date", {"iso-date": iso_date(transaction_date)})
+        value = rng.uniform(100, 100000) * (1.1 if revised else 1)
+        etree.SubElement(transaction, "value", {"currency": "GBP", "value-date": iso_date(transaction_date)}).text = "{:.2f}".format(value)
+        transaction.append(narrative_element("description", "Transaction {}".format(transaction_index + 1)))
+        transaction.append(narrative_element("provider-org", provider_name, ref=provider_ref))
+        receiver_org = narrative_element("receiver-org", "Development Initiatives", ref=REPORTING_ORG_REF)
+        receiver_org.set("receiver-activity-id", iati_identifier)
+        transaction.append(receiver_org)
+
+    for result_index in range(results):
+        result = etree.SubElement(activity, "result", {"type": "1", "aggregation-status": "0"})
+        result.append(narrative_element("title", "Result {}".format(result_index + 1)))
+        result.append(narrative_element("description", "Results measure"))
+        indicator = etree.SubElement(result, "indicator", measure="1", ascending="1")
+        indicator.append(narrative_element("title", "Indicator {}".format(result_index + 1)))
+        etree.SubElement(indicator, "baseline", year=str(start_date.year), value=str(rng.randrange(100)))
+        period = etree.SubElement(indicator, "period")
+        etree.SubElement(period, "period-start", {"iso-date": iso_date(start_date)})
+        etree.SubElement(period, "period-end", {"iso-date": iso_date(start_date + timedelta(days=364))})
+        etree.SubElement(period, "target", value=str(rng.randrange(100, 1000)))
+        etree.SubElement(period, "actual", value=str(rng.randrange(100, 1000)))
+    return activity
+
+
+def generate_xml(xml_filename, activity_count, transactions=18, budgets=4, results=0, first_index=0, revised_every=0):
+    # Activities are written as they are built, so memory doesn't grow with the file. No declaration, which pyIATI rejects
+    with etree.xmlfile(xml_filename, encoding="utf-8") as xmlfile:
+        with xmlfile.element("iati-activities", {"version": "2.03", "generated-datetime": GENERATED_DATETIME}):
+            for activity_index in range(first_index, first_index + activity_count):
+                revised = bool(revised_every) and activity_index % revised_every == 0
+                xmlfile.write("\n")
+                xmlfile.write(synthetic_activity(activity_index, transactions, budgets, results, revised), pretty_print=True)
+
+
+def generate_publications(past_xml_filename, current_xml_filename, activity_count, transactions=18, budgets=4, results=0):
+    # A past publication, and a current one that drops the first 5% of activities, adds as many and revises one in ten
+    turnover = activity_count // 20
+    generate_xml(past_xml_filename, activity_count, transactions, budgets, results)
+    generate_xml(current_xml_filename, activity_count, transactions, budgets, results, first_index=turnover, revised_every=10)
+
+
+def parse_arguments(argv):
+    parser = argparse.ArgumentParser(description="Write a synthetic IATI 2.03 activity file for benchmarking.")
+    parser.add_argument("xml_filename")
+    parser.add_argument("activities", type=int)
+    parser.add_argument("--transactions", type=int, default=18, help="Transactions per activity")
+    parser.add_argument("--budgets", type=int, default=4, help="Budgets per activity")
+    parser.add_argument("--results", type=int, default=0, help="Results per activity")
+    parser.add_argument("--first-index", type=int, default=0, help="Index of the first activity, to shift the identifiers")
+    parser.add_argument("--revised-every", type=int, default=0, help="Revise every Nth activity, to make a later publication")
+    return parser.parse_args(argv)
+
+
+if __name__ == "__main__":
+    arguments = parse_arguments(sys.argv[1:])
+    generate_xml(arguments.xml_filename, arguments.activities, arguments.transactions, arguments.budgets, arguments.results,
+                 arguments.first_index, arguments.revised_every)
@@ -0,0 +1,48 @@
+import os
+import sys
+import shutil
+import pytest
+import pandas as pd
+
+REPO_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, REPO_DIR)
+
+PAST_XML_FILENAME = os.path.join(REPO_DIR, "test_data", "DIPR IATI data February 2018.xml")
+CURRENT_XML_FILENAME = os.path.join(REPO_DIR, "test_data", "DIPR IATI data June 2019.xml")
+
+
+def error_rows(errors_filename):
+    # Validation errors as a sorted list of rows, as their order isn't fixed
+    errors_df = pd.read_csv(errors_filename, index_col=0, dtype=str, keep_default_na=False)
+    return sorted(errors_df.itertuples(index=False, name=None))
+
+
+@pytest.fixture(params=[PAST_XML_FILENAME, CURRENT_XML_FILENAME], ids=["february-2018", "june-2019"])
+def xml_filename(request):
+    return request.param
+
+
+@pytest.fixture(scope="session")
+def past_xml_filename():
+    return PAST_XML_FILENAME
+
+
+@pytest.fixture(scope="session")
+def current_xml_filename():
+    return CURRENT_XML_FILENAME
+
+
+@pytest.fixture(scope="session")
+def converted_csv_dir(tmp_path_factory, current_xml_filename):
+    # The June 2019 publication as CSVs, converted once; tests that write into a CSV directory copy it first
+    from utils import xml_to_csv
+    csv_dir = str(tmp_path_factory.mktemp("converted") / "csvs")
+    xml_to_csv(current_xml_filename, csv_dir)
+    return csv_dir
+
+
+@pytest.fixture
+def csv_dir(converted_csv_dir, tmp_path):
+    csv_dir = str(tmp_path / "csvs")
+    shutil.copytree(converted_csv_dir, csv_dir)
+    return csv_dir
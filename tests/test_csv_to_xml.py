@@ -0,0 +1,87 @@
+import os
+import re
+import shutil
+import sqlite3
+import contextlib
+import pytest
+from lxml import etree
+from utils import xml_to_csv, csv_to_xml, read_melted_csv, is_long_sqlite_table, CSV_BASENAMES, SQLITE_STORE_BASENAME
+from conftest import error_rows
+
+GENERATED_DATETIME_PATTERN = re.compile(rb' generated-datetime="[^"]*"')
+ID_COLUMN = "iati-activity/iati-identifier[1]"
+
+
+def read_xml(xml_filename):
+    # The time of building is the only thing allowed to differ between two builds
+    with open(xml_filename, "rb") as xml_file:
+        return GENERATED_DATETIME_PATTERN.sub(b"", xml_file.read())
+
+
+def test_workers_match_serial(csv_dir, tmp_path):
+    # Also compares the chunked CSV reader, used with one worker, against open_csv_dir
+    serial_xml_filename = str(tmp_path / "serial.xml")
+    pooled_xml_filename = str(tmp_path / "pooled.xml")
+    csv_to_xml(csv_dir, serial_xml_filename)
+    csv_to_xml(csv_dir, pooled_xml_filename, workers=2)
+    assert read_xml(serial_xml_filename) == read_xml(pooled_xml_filename)
+
+
+def test_incremental_matches_full_rebuild(csv_dir, tmp_path):
+    incremental_xml_filename = str(tmp_path / "incremental.xml")
+    full_xml_filename = str(tmp_path / "full.xml")
+    csv_to_xml(csv_dir, incremental_xml_filename, validation_workers=1, incremental=True)
+
+    # Retitle one activity and drop another, rows and all
+    activities_df = read_melted_csv(os.path.join(csv_dir, "activities_static.csv"))
+    changed_id, removed_id = activities_df[ID_COLUMN].iloc[3], activities_df[ID_COLUMN].iloc[5]
+    for csv_basename in CSV_BASENAMES:
+        csv_filename = os.path.join(csv_dir, csv_basename)
+        csv_df = read_melted_csv(csv_filename)
+        csv_df = csv_df[csv_df[ID_COLUMN] != removed_id]
+        if csv_basename == "activities_static.csv":
+            csv_df.loc[csv_df[ID_COLUMN] == changed_id, "iati-activity/title[1]/narrative[1]"] = "A changed title"
+        csv_df.to_csv(csv_filename, index=False)
+
+    incremental_summary = csv_to_xml(csv_dir, incremental_xml_filename, validation_workers=1, incremental=True)
+    incremental_error_rows = error_rows(os.path.join(csv_dir, "output_validation_errors.csv"))
+    full_summary = csv_to_xml(csv_dir, full_xml_filename, validation_workers=1)
+    full_error_rows = error_rows(os.path.join(csv_dir, "output_validation_errors.csv"))
+    assert read_xml(incremental_xml_filename) == read_xml(full_xml_filename)
+    assert incremental_summary["validation"] == full_summary["validation"]
+    assert incremental_error_rows == full_error_rows
+
+
+@pytest.mark.parametrize("streaming", [False, True])
+def test_sqlite_matches_csv(current_xml_filename, converted_csv_dir, tmp_path, streaming):
+    csv_xml_filename = str(tmp_path / "from_csv.xml")
+    csv_to_xml(shutil.copytree(converted_csv_dir, str(tmp_path / "csvs")), csv_xml_filename)
+    sqlite_dir = str(tmp_path / "sqlite")
+    xml_to_csv(current_xml_filename, sqlite_dir, streaming=streaming, sqlite=True)
+    for workers in [1, 2]:
+        sqlite_xml_filename = str(tmp_path / "from_sqlite_{}.xml".format(workers))
+        csv_to_xml(sqlite_dir, sqlite_xml_filename, workers=workers, sqlite=True)
+        assert read_xml(sqlite_xml_filename) == read_xml(csv_xml_filename)
+
+
+def test_wide_sqlite_table_matches_csv(current_xml_filename, tmp_path):
+    # Hundreds of sectors make the activities table wider than SQLite tables are kept, so it is stored long
+    tree = etree.parse(current_xml_filename)
+    del tree.getroot()[3:]  # A few activities are enough, and keep validation quick
+    activity = tree.getroot().find("iati-activity")
+    for sector_index in range(300):
+        etree.SubElement(activity, "sector", code=str(11110 + sector_index), vocabulary="1", percentage="0")
+    wide_xml_filename = str(tmp_path / "wide.xml")
+    tree.write(wide_xml_filename, encoding="utf-8")
+
+    csv_dir = str(tmp_path / "csvs")
+    sqlite_dir = str(tmp_path / "sqlite")
+    xml_to_csv(wide_xml_filename, csv_dir)
+    xml_to_csv(wide_xml_filename, sqlite_dir, sqlite=True)
+    with contextlib.closing(sqlite3.connect(os.path.join(sqlite_dir, SQLITE_STORE_BASENAME))) as connection:
+        assert is_long_sqlite_table(connection, "activities")
+    csv_xml_filename = str(tmp_path / "from_csv.xml")
+    sqlite_xml_filename = str(tmp_path / "from_sqlite.xml")
+    csv_to_xml(csv_dir, csv_xml_filename)
+    csv_to_xml(sqlite_dir, sqlite_xml_filename, sqlite=True)
+    assert read_xml(sqlite_xml_filename) == read_xml(csv_xml_filename)
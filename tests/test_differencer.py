@@ -0,0 +1,39 @@
+import pytest
+from utils import xml_differencer, manifest_filename_for
+from synthetic import generate_publications
+
+
+def read_bytes(filename):
+    with open(filename, "rb") as output_file:
+        return output_file.read()
+
+
+def assert_external_matches_in_memory(past_xml_filename, current_xml_filename, tmp_path, memory_budget_mb, **kwargs):
+    in_memory_xml_filename = str(tmp_path / "in_memory.xml")
+    external_xml_filename = str(tmp_path / "external.xml")
+    in_memory_summary = xml_differencer(past_xml_filename, current_xml_filename, in_memory_xml_filename, write_manifest=True, **kwargs)
+    external_summary = xml_differencer(past_xml_filename, current_xml_filename, external_xml_filename, write_manifest=True,
+                                       memory_budget_mb=memory_budget_mb, **kwargs)
+    assert read_bytes(in_memory_xml_filename) == read_bytes(external_xml_filename)
+    assert read_bytes(manifest_filename_for(in_memory_xml_filename)) == read_bytes(manifest_filename_for(external_xml_filename))
+    assert in_memory_summary == external_summary
+
+
+@pytest.mark.parametrize("ignore_datetimes", [False, True])
+def test_external_matches_in_memory(past_xml_filename, current_xml_filename, tmp_path, ignore_datetimes):
+    assert_external_matches_in_memory(past_xml_filename, current_xml_filename, tmp_path, 1, ignore_datetimes=ignore_datetimes)
+
+
+def test_external_matches_in_memory_from_manifest(past_xml_filename, current_xml_filename, tmp_path):
+    # The past publication's manifest, saved by differencing it against itself, stands in for the file
+    past_updated_xml_filename = str(tmp_path / "past_updated.xml")
+    xml_differencer(past_xml_filename, past_xml_filename, past_updated_xml_filename, write_manifest=True)
+    assert_external_matches_in_memory(manifest_filename_for(past_updated_xml_filename), current_xml_filename, tmp_path, 1)
+
+
+def test_external_matches_in_memory_across_runs(tmp_path):
+    # Enough activities, in a small enough budget, that the sorted records spill to several runs on disk
+    past_xml_filename = str(tmp_path / "past.xml")
+    current_xml_filename = str(tmp_path / "current.xml")
+    generate_publications(past_xml_filename, current_xml_filename, 5000, transactions=1, budgets=1)
+    assert_external_matches_in_memory(past_xml_filename, current_xml_filename, tmp_path, 0.1)
@@ -0,0 +1,42 @@
+import os
+import filecmp
+from lxml import etree
+from utils import xml_to_csv, read_melted_csv, CSV_BASENAMES
+from conftest import error_rows
+
+
+def melted_rows(csv_filename):
+    # Each row's non-empty cells, as an update keeps the columns already there in their place
+    return [sorted((column, value) for column, value in row.items() if value != "") for row in read_melted_csv(csv_filename).to_dict("records")]
+
+
+def test_streaming_matches_in_memory(xml_filename, tmp_path):
+    in_memory_dir = str(tmp_path / "in_memory")
+    streaming_dir = str(tmp_path / "streaming")
+    in_memory_summary = xml_to_csv(xml_filename, in_memory_dir)
+    streaming_summary = xml_to_csv(xml_filename, streaming_dir, streaming=True)
+    for csv_basename in CSV_BASENAMES:
+        assert filecmp.cmp(os.path.join(in_memory_dir, csv_basename), os.path.join(streaming_dir, csv_basename), shallow=False), csv_basename
+    assert [in_memory_summary[count] for count in ["activities", "transactions", "budgets"]] == \
+        [streaming_summary[count] for count in ["activities", "transactions", "budgets"]]
+
+
+def test_update_matches_full_conversion(current_xml_filename, tmp_path):
+    # Retitle one activity and drop another from a later publication
+    tree = etree.parse(current_xml_filename)
+    activities = tree.getroot().findall("iati-activity")
+    activities[3].find("title/narrative").text = "A changed title"
+    tree.getroot().remove(activities[5])
+    later_xml_filename = str(tmp_path / "later.xml")
+    tree.write(later_xml_filename, encoding="utf-8")
+
+    updated_dir = str(tmp_path / "updated")
+    full_dir = str(tmp_path / "full")
+    xml_to_csv(current_xml_filename, updated_dir, validation_workers=1)
+    updated_summary = xml_to_csv(later_xml_filename, updated_dir, validation_workers=1, update=True)
+    full_summary = xml_to_csv(later_xml_filename, full_dir, validation_workers=1)
+    assert updated_summary["unchanged-activities"] == len(activities) - 2
+    assert updated_summary["validation"] == full_summary["validation"]
+    assert error_rows(os.path.join(updated_dir, "input_validation_errors.csv")) == error_rows(os.path.join(full_dir, "input_validation_errors.csv"))
+    for csv_basename in CSV_BASENAMES:
+        assert melted_rows(os.path.join(updated_dir, csv_basename)) == melted_rows(os.path.join(full_dir, csv_basename)), csv_basename
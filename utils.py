@@ -1,14 +1,33 @@
+import io
 import os
 import re
 import sys
 import glob
+import copy
+import heapq
+import bisect
+import json
+import hashlib
+import pickle
+import sqlite3
+import tempfile
+import time
 import datetime
+import functools
+import contextlib
+import itertools
 import pytz
 from lxml import etree
 import pandas as pd
-from collections import OrderedDict
+from collections import OrderedDict, deque
+from concurrent.futures import ProcessPoolExecutor
+try:
+    import resource
+except ImportError:  # Unavailable on Windows, where peak memory goes unreported
+    resource = None
 import iati
 import iati.validator
+import iati.exceptions
 import iati.utilities
 import iati.resources
 
@@ -37,11 +56,260 @@ def resource_filesystem_path(path):
 
 iati.resources.resource_filesystem_path = resource_filesystem_path
 
-v203_schema = iati.default.activity_schema("2.03")
+
+def pyiati_version():
+    # pyIATI has no __version__, so its installed distribution is asked; None if a bundle left out its metadata
+    try:
+        from importlib import metadata
+    except ImportError:  # Before Python 3.8
+        import pkg_resources
+        try:
+            return pkg_resources.get_distribution("pyIATI").version
+        except pkg_resources.DistributionNotFound:
+            return None
+    try:
+        return metadata.version("pyIATI")
+    except metadata.PackageNotFoundError:
+        return None
+
+
+def resources_hash(version):
+    # Content hash of every resource the populated Schema is built from
+    resource_digest = hashlib.sha1()
+    for resource_folder in [iati.resources.folder_name_for_version(version), "version_independent"]:
+        for dirpath, dirnames, filenames in os.walk(os.path.join(IATI_FOLDER, "resources", "standard", resource_folder)):
+            dirnames.sort()
+            for filename in sorted(filenames):
+                resource_path = os.path.join(dirpath, filename)
+                resource_digest.update(os.path.relpath(resource_path, IATI_FOLDER).replace(os.sep, "/").encode("utf-8"))
+                with open(resource_path, "rb") as resource_file:
+                    resource_digest.update(resource_file.read())
+    return resource_digest.hexdigest()
+
+
+def load_activity_schema(version):
+    # The populated Schema, cached on disk keyed by the resources, Python and pyIATI version it was built with
+    schema_library_version = pyiati_version()
+    if schema_library_version is None:  # The pickle rebuilds pyIATI internals, so it is only trusted from a known version
+        return iati.default.activity_schema(version)
+    cache_prefix = "activity-schema-{}-py{}{}-".format(version, *sys.version_info[:2])
+    cache_filename = os.path.join(SCHEMA_CACHE_DIR, "{}pyiati{}-{}.pickle".format(cache_prefix, schema_library_version, resources_hash(version)))
+    try:
+        with open(cache_filename, "rb") as cache_file:
+            cached_schema = pickle.load(cache_file)
+        source_path = os.path.join(IATI_FOLDER, cached_schema["source_path"])
+        schema = iati.ActivitySchema.__new__(iati.ActivitySchema)
+        schema._schema_base_tree = etree.fromstring(cached_schema["schema_tree"], base_url=source_path).getroottree()  # Base URL resolves the xsd:includes
+        schema._source_path = source_path
+        schema.codelists = cached_schema["codelists"]
+        schema.rulesets = cached_schema["rulesets"]
+        return schema
+    except (OSError, EOFError, KeyError, AttributeError, ImportError, pickle.UnpicklingError, etree.XMLSyntaxError):
+        pass
+
+    schema = iati.default.activity_schema(version)
+    cached_schema = {
+        "schema_tree": etree.tostring(schema._schema_base_tree),
+        "source_path": os.path.relpath(schema._source_path, IATI_FOLDER),
+        "codelists": schema.codelists,
+        "rulesets": schema.rulesets,
+    }
+    try:
+        if not os.path.exists(SCHEMA_CACHE_DIR):
+            os.makedirs(SCHEMA_CACHE_DIR)
+        for stale_filename in glob.glob(os.path.join(SCHEMA_CACHE_DIR, cache_prefix + "*.pickle")):
+            os.remove(stale_filename)
+        with tempfile.NamedTemporaryFile(dir=SCHEMA_CACHE_DIR, delete=False) as cache_file:
+            pickle.dump(cached_schema, cache_file, pickle.HIGHEST_PROTOCOL)
+        os.replace(cache_file.name, cache_filename)
+    except OSError:  # A read-only or missing cache directory only costs the warm start
+        pass
+    return schema
+
+
+SCHEMA_CACHE_DIR = os.environ.get("IATI_EDITOR_CACHE", os.path.join(os.path.expanduser("~"), ".cache", "iati-editor"))
+v203_schema = None
+
+
+def get_v203_schema():
+    # Loaded on first validation rather than at import, so the tools start quickly
+    global v203_schema
+    if v203_schema is None:
+        v203_schema = load_activity_schema("2.03")
+    return v203_schema
+
+
+codelist_checks = None
+
+
+def get_codelist_checks():
+    # Loaded on the first conversion from CSV, as the schema is
+    global codelist_checks
+    if codelist_checks is None:
+        codelist_checks = load_codelist_checks("2.03")
+    return codelist_checks
+
+
+progress_handler = None  # Called with (stage, done, total) as activities are processed; may raise ConversionCancelled
+TRACE_FILENAME = os.environ.get("IATI_EDITOR_TRACE")  # JSON lines file every traced run is appended to
+pipeline_trace = None
+
+
+class ConversionCancelled(Exception):
+    pass
+
+
+def report_progress(stage_name, done, total=0):
+    # total is 0 when it isn't known in advance
+    if progress_handler is not None:
+        progress_handler(stage_name, done, total)
+
+
+def peak_rss_mb():
+    # Peak resident memory of this process so far, in megabytes (ru_maxrss is in kilobytes on Linux, bytes on macOS)
+    if resource is None:
+        return None
+    peak_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return round(peak_rss / (1024.0 * 1024.0 if sys.platform == "darwin" else 1024.0), 1)
+
+
+def cpu_seconds():
+    # Including worker processes that have finished, such as the cast and validation pools
+    process_times = os.times()
+    return process_times.user + process_times.system + process_times.children_user + process_times.children_system
+
+
+class TraceStage(object):
+    # Wall time, CPU time, item count and the process's peak memory on leaving a stage, and how far the stage raised it
+    def __init__(self, name):
+        self.name = name
+        self.items = None
+
+    def __enter__(self):
+        self.start_rss_mb = peak_rss_mb()
+        self.start_cpu_seconds = cpu_seconds()
+        self.start_time = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        wall_seconds = time.perf_counter() - self.start_time
+        end_rss_mb = peak_rss_mb()
+        pipeline_trace["stages"].append(OrderedDict([
+            ("stage", self.name),
+            ("wall-seconds", round(wall_seconds, 3)),
+            ("cpu-seconds", round(cpu_seconds() - self.start_cpu_seconds, 3)),
+            ("process-peak-rss-mb", end_rss_mb),  # The high-water mark of the whole process, earlier stages included
+            ("process-peak-rss-growth-mb", None if end_rss_mb is None else round(end_rss_mb - self.start_rss_mb, 1)),
+            ("items", self.items),
+        ]))
+
+
+class UntracedStage(object):
+    # Stands in for TraceStage when nothing is being traced, so stages cost next to nothing
+    items = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        pass
+
+
+UNTRACED_STAGE = UntracedStage()
+
+
+def trace_stage(name):
+    if pipeline_trace is None:
+        return UNTRACED_STAGE
+    return TraceStage(name)
+
+
+def print_trace_summary(trace):
+    # Stages run more than once, such as writing each CSV, are summed
+    stage_totals = OrderedDict()
+    for stage_record in trace["stages"]:
+        stage_total = stage_totals.setdefault(stage_record["stage"], OrderedDict([("wall-seconds", 0), ("cpu-seconds", 0), ("process-peak-rss-growth-mb", None),
+                                                                                  ("process-peak-rss-mb", None), ("items", None)]))
+        stage_total["wall-seconds"] += stage_record["wall-seconds"]
+        stage_total["cpu-seconds"] += stage_record["cpu-seconds"]
+        if stage_record["process-peak-rss-growth-mb"] is not None:
+            stage_total["process-peak-rss-growth-mb"] = round((stage_total["process-peak-rss-growth-mb"] or 0) + stage_record["process-peak-rss-growth-mb"], 1)
+        stage_total["process-peak-rss-mb"] = stage_record["process-peak-rss-mb"]
+        if stage_record["items"] is not None:
+            stage_total["items"] = (stage_total["items"] or 0) + stage_record["items"]
+    print("{} stages:".format(trace["pipeline"]))
+    print("{:<16}{:>10}{:>10}{:>14}{:>16}{:>10}".format("stage", "wall s", "cpu s", "peak rise MB", "process peak MB", "items"))
+    for stage_name, stage_total in stage_totals.items():
+        print("{:<16}{:>10.3f}{:>10.3f}{:>14}{:>16}{:>10}".format(stage_name, stage_total["wall-seconds"], stage_total["cpu-seconds"],
+                                                              "-" if stage_total["process-peak-rss-growth-mb"] is None else stage_total["process-peak-rss-growth-mb"],
+                                                              "-" if stage_total["process-peak-rss-mb"] is None else stage_total["process-peak-rss-mb"],
+                                                              "-" if stage_total["items"] is None else stage_total["items"]))
+    print("{:<16}{:>10.3f}{:>10.3f}".format("total", trace["wall-seconds"], trace["cpu-seconds"]))
+
+
+def traced_pipeline(pipeline_function):
+    # Traces the stages of a pipeline when it is called with instrument=True, or IATI_EDITOR_TRACE names a trace file
+    @functools.wraps(pipeline_function)
+    def traced_pipeline_function(*args, instrument=False, **kwargs):
+        global pipeline_trace
+        if not (instrument or TRACE_FILENAME) or pipeline_trace is not None:  # Stages of a nested pipeline join the outer trace
+            return pipeline_function(*args, **kwargs)
+        pipeline_trace = OrderedDict([("pipeline", pipeline_function.__name__), ("started", datetime.datetime.now().isoformat()), ("stages", [])])
+        start_cpu_seconds = cpu_seconds()
+        start_time = time.perf_counter()
+        try:
+            result = pipeline_function(*args, **kwargs)
+        finally:
+            trace = pipeline_trace
+            pipeline_trace = None
+        trace["wall-seconds"] = round(time.perf_counter() - start_time, 3)
+        trace["cpu-seconds"] = round(cpu_seconds() - start_cpu_seconds, 3)
+        trace["process-peak-rss-mb"] = peak_rss_mb()
+        if instrument:
+            print_trace_summary(trace)
+        if TRACE_FILENAME:
+            with open(TRACE_FILENAME, "a") as trace_file:
+                trace_file.write(json.dumps(trace) + "\n")
+        if isinstance(result, OrderedDict):
+            result["stages"] = trace["stages"]
+        return result
+    return traced_pipeline_function
+
 
 XPATH_SEPERATOR = "/"
 ATTRIB_SEPERATOR = "@"
 EXCLUDED_CHILDREN_TAGS = ["budget", "transaction"]
+STREAM_CHUNK_SIZE = 1000
+MELT_KEYS = {}
+ACTIVITY_KEY_TABLES = {}
+CHUNKS_PER_WORKER = 4
+CAST_CHUNKS_QUEUED_PER_WORKER = 2
+VALIDATION_CHUNK_SIZE = 50
+VALIDATION_CHUNKS_PER_WORKER = 2  # Chunks queued for each validation worker, so the document is never held as chunks at once
+VALIDATION_ERROR_COLUMNS = ["info", "description", "status", "iati-activity/iati-identifier[1]"]
+SCHEMA_ERROR_CATEGORIES = ["xml", "iati-xml", "tool-lxml"]
+DATETIME_ATTRIBUTES = ["generated-datetime", "last-updated-datetime"]
+FINGERPRINT_MANIFEST_SUFFIX = "_fingerprints.json"
+ROW_MANIFEST_SUFFIX = "_rows.json"
+CHANGESET_SUFFIX = "_changes.csv"
+DIFF_MEMORY_BUDGET_MB = 256  # For the differencer's external mode, which sorts activity records on disk
+DIFF_RUN_RECORD_BYTES = 256  # Rough size of one (identifier, position, fingerprint) record held while sorting a run
+CHANGESET_COLUMNS = ["iati-activity/iati-identifier[1]", "xpath", "change", "old-value", "new-value"]
+SOURCE_MANIFEST_BASENAME = "source" + FINGERPRINT_MANIFEST_SUFFIX
+SQLITE_STORE_BASENAME = "activities.sqlite"
+CSV_ERRORS_BASENAME = "csv_validation_errors.csv"
+CSV_ERROR_COLUMNS = ["file", "row", "column", "value", "problem", "status"]
+CSV_BASENAMES = ["activities_static.csv", "activities_additions.csv", "transactions.csv", "budgets.csv"]
+ISO_DATE_PATTERN = r"^\d{4}-\d{2}-\d{2}$"
+DATE_COLUMN_PATTERN = re.compile(r"@(iso-date|value-date)$")
+NUMBER_COLUMN_PATTERN = re.compile(r"((^|/)value\[\d+\]|@percentage)$")
+SQLITE_TABLES = ["activities", "additions", "transactions", "budgets"]  # In melt_iati order
+SQLITE_MAX_WIDE_COLUMNS = 1000  # Wider tables are stored long, a row per value, as SQLite allows at most 2000 columns
+ROW_MANIFEST_VERSION = 1
+FINGERPRINT_OPEN = "\x01"  # Control characters cannot occur in XML 1.0 content, so token boundaries are unambiguous
+FINGERPRINT_CLOSE = "\x02"
+FINGERPRINT_ATTRIB = "\x03"
+FINGERPRINT_TEXT = "\x04"
 SORT_ORDER = {
     "iati-activities/iati-activity": 0,
     "iati-activity/iati-identifier": 1,
@@ -368,6 +636,18 @@ def iati_order(xml_element):
     return SORT_ORDER[family_tag], activity_date_type
 
 
+def child_sort_orders():
+    # SORT_ORDER regrouped as parent tag -> child tag -> order
+    sort_orders = {}
+    for family_tag, sort_order in SORT_ORDER.items():
+        parent_tag, child_tag = family_tag.split(XPATH_SEPERATOR)
+        sort_orders.setdefault(parent_tag, {})[child_tag] = sort_order
+    return sort_orders
+
+
+CHILD_SORT_ORDERS = child_sort_orders()
+
+
 def iati_order_xpath(xpath_key):
     xpath_without_attribute = xpath_key.split(ATTRIB_SEPERATOR)[0]
     xpath_split = [elem_xpath.split("[")[0] for elem_xpath in xpath_without_attribute.split(XPATH_SEPERATOR)]
@@ -396,307 +676,849 @@ def create_ancestor_tag(absolute_xpath):
     return ancestor_tag
 
 
-def remove_xpath_index(relative_xpath):
-    split_path = relative_xpath.split("[")
-    indexless_path = "[".join(split_path[:-1])
-    return indexless_path
+def melt_key(parent_key, separator, name, index=None):
+    # Column keys are built once per distinct path and shared by every row that has them
+    key_parts = (parent_key, separator, name, index)
+    column_key = MELT_KEYS.get(key_parts)
+    if column_key is None:
+        if index is None:
+            column_key = "{}{}{}".format(parent_key, separator, name)
+        else:
+            column_key = "{}{}{}[{}]".format(parent_key, separator, name, index)
+        MELT_KEYS[key_parts] = column_key
+    return column_key
 
 
-def increment_xpath(absolute_xpath):
-    split_path = absolute_xpath.split("[")
-    indexless_path = "[".join(split_path[:-1])
-    path_index = int(split_path[-1][:-1])
-    path_index += 1
-    incremented_xpath = "{}[{}]".format(indexless_path, path_index)
-    return incremented_xpath
+def melt_element(element, element_key, melted_values):
+    # Main value
+    melted_values.append((element_key, str(element.text) if element.text else ""))
 
+    # Attribute values
+    for attrib_key, attrib_value in element.attrib.items():
+        melted_values.append((melt_key(element_key, ATTRIB_SEPERATOR, attrib_key), str(attrib_value) if attrib_value else ""))
+
+    # Child values, indexed by a running count of same-tag siblings
+    sibling_counts = {}
+    for child_elem in element.iterchildren(etree.Element):
+        child_elem_tag = child_elem.tag
+        if child_elem_tag not in EXCLUDED_CHILDREN_TAGS:
+            sibling_index = sibling_counts.get(child_elem_tag, 0) + 1
+            sibling_counts[child_elem_tag] = sibling_index
+            melt_element(child_elem, melt_key(element_key, XPATH_SEPERATOR, child_elem_tag, sibling_index), melted_values)
+
+
+class MeltTable(object):
+    # Melted rows held as one value list per column, None where a row has no value
+    def __init__(self):
+        self.columns = OrderedDict()
+        self.row_count = 0
+
+    def __len__(self):
+        return self.row_count
+
+    def add_value(self, column_key, value):
+        column_values = self.columns.get(column_key)
+        if column_values is None:
+            column_values = self.columns[column_key] = []
+        if len(column_values) < self.row_count:
+            column_values.extend([None] * (self.row_count - len(column_values)))
+        column_values.append(value)
+
+    def has_value(self, column_key):
+        column_values = self.columns.get(column_key)
+        return column_values is not None and len(column_values) > self.row_count
+
+    def end_row(self):
+        self.row_count += 1
+
+    def records(self):
+        column_items = list(self.columns.items())
+        for row_index in range(self.row_count):
+            yield {column_key: column_values[row_index] for column_key, column_values in column_items if row_index < len(column_values) and column_values[row_index] is not None}
+
+    def to_frame(self):
+        for column_values in self.columns.values():
+            column_values.extend([None] * (self.row_count - len(column_values)))
+        return pd.DataFrame(self.columns, columns=list(self.columns.keys()), index=pd.RangeIndex(self.row_count), dtype=str)
+
+
+def activity_key_tables(column_key):
+    # Whether an activity column belongs in the static table, the additions table, or (the identifier) both
+    key_tables = ACTIVITY_KEY_TABLES.get(column_key)
+    if key_tables is None:
+        ancestor_tag = create_ancestor_tag(column_key)
+        key_tables = (ancestor_tag not in ADDITIONAL_TAGS or ancestor_tag == "iati-activity/iati-identifier", ancestor_tag in ADDITIONAL_TAGS)
+        ACTIVITY_KEY_TABLES[column_key] = key_tables
+    return key_tables
+
+
+def melt_child_records(activity, record_tag, activity_id, records_table):
+    for record in activity.iterchildren(record_tag):
+        record_values = []
+        melt_element(record, record_tag, record_values)
+        for column_key, value in record_values:
+            records_table.add_value(column_key, value)
+        records_table.add_value("iati-activity/iati-identifier[1]", activity_id)
+        records_table.end_row()
+
+
+def melt_activity(activity, activities_static, activities_additions, transactions, budgets):
+    activity_values = []
+    melt_element(activity, "iati-activity", activity_values)
+    activity_id = None
+    for column_key, value in activity_values:
+        in_static, in_additions = activity_key_tables(column_key)
+        if in_static:
+            activities_static.add_value(column_key, value)
+        if in_additions:
+            activities_additions.add_value(column_key, value)
+        if column_key == "iati-activity/iati-identifier[1]":
+            activity_id = value  # To key transactions and budgets
+    for default_col, default_val in DEFAULT_ADDITIONAL_COLUMNS:
+        if not activities_additions.has_value(default_col):
+            activities_additions.add_value(default_col, default_val)
+    activities_static.end_row()
+    activities_additions.end_row()
+
+    melt_child_records(activity, "transaction", activity_id, transactions)
+    melt_child_records(activity, "budget", activity_id, budgets)
 
-def recursive_tree_traversal(element, absolute_xpath, element_dictionary):
-    # Main value
-    element_value = str(element.text) if element.text else ""
-    while absolute_xpath in element_dictionary:
-        absolute_xpath = increment_xpath(absolute_xpath)
 
-    element_dictionary[absolute_xpath] = element_value
+def melt_iati(root):
+    melt_tables = (MeltTable(), MeltTable(), MeltTable(), MeltTable())
+    for activity_index, activity in enumerate(root.iterchildren(etree.Element)):
+        melt_activity(activity, *melt_tables)
+        report_progress("Melting activities", activity_index + 1, len(root))
+    return melt_tables
+
+
+def xpath_steps(relative_xpath):
+    # "result[1]/indicator[2]" -> (("result", 1), ("indicator", 2)), an unindexed step being the first
+    steps = []
+    for step in relative_xpath.split(XPATH_SEPERATOR):
+        step_tag, _, step_index = step.partition("[")
+        steps.append((step_tag, int(step_index[:-1]) if step_index else 1))
+    return tuple(steps)
+
+
+def steps_order(record_tag, steps):
+    # Document position of the element at steps, so elements can be created in IATI order
+    parent_tag = record_tag
+    step_orders = []
+    for step_tag, step_index in steps:
+        step_orders.append((CHILD_SORT_ORDERS.get(parent_tag, {}).get(step_tag, len(SORT_ORDER)), step_index))
+        parent_tag = step_tag
+    return tuple(step_orders)
+
+
+def compile_column_plan(columns, record_tag):
+    # Resolve each of a table's columns to (column, element steps, attribute) once, in creation order
+    column_plan = []
+    for column_key in sorted(columns, key=xpath_sort):
+        if column_key == record_tag:  # Text of the record element itself
+            column_plan.append((column_key, (), ""))
+            continue
+        if column_key[:len(record_tag)] != record_tag or column_key[len(record_tag):len(record_tag)+1] not in (XPATH_SEPERATOR, ATTRIB_SEPERATOR):
+            continue  # Not part of this record, e.g. the activity identifier of a transaction
+        relative_key = column_key[len(record_tag)+1:]
+        if column_key[len(record_tag)] == ATTRIB_SEPERATOR:  # Attributes applied to top level element
+            column_plan.append((column_key, (), relative_key))
+            continue
+        child_xpath_without_attribute, _, child_attribute_key = relative_key.partition(ATTRIB_SEPERATOR)
+        column_plan.append((column_key, xpath_steps(child_xpath_without_attribute), child_attribute_key))
+    column_plan.sort(key=lambda plan_entry: steps_order(record_tag, plan_entry[1]))  # Each insertion is then an append
+    return column_plan
 
-    # Attribute values
-    element_attributes = element.attrib
-    for attrib_key in element_attributes.keys():
-        attribute_xpath = ATTRIB_SEPERATOR.join([absolute_xpath, attrib_key])
-        attribute_value = str(element_attributes[attrib_key]) if element_attributes[attrib_key] else ""
-        element_dictionary[attribute_xpath] = attribute_value
-
-    # Child values
-    element_children = element.getchildren()
-    if not element_children:
-        return element_dictionary
+
+def table_columns(records_list):
+    return list(records_list[0].keys()) if records_list else []
+
+
+def insert_child(parent_elem, child_tag):
+    # New children go after every sibling that sorts before or level with them, where a stable IATI order sort would leave them
+    child_orders = CHILD_SORT_ORDERS[parent_elem.tag]
+    child_order = child_orders[child_tag]
+    child_elem = etree.Element(child_tag)
+    for sibling_elem in parent_elem.iterchildren(reversed=True):  # Walked from the end, as positional indexing is linear in lxml
+        if child_orders[sibling_elem.tag] <= child_order:
+            sibling_elem.addnext(child_elem)
+            break
     else:
-        for child_elem in element_children:
-            child_elem_tag = child_elem.tag
-            if child_elem_tag not in EXCLUDED_CHILDREN_TAGS:
-                child_absolute_xpath = XPATH_SEPERATOR.join([absolute_xpath, child_elem_tag]) + "[1]"
-                element_dictionary = recursive_tree_traversal(child_elem, child_absolute_xpath, element_dictionary)
+        parent_elem.insert(0, child_elem)
+    return child_elem
 
-    return element_dictionary
 
+def order_activity_dates(activity_elem):
+    # activity-date@type is only known once the activity's columns are cast, so its run of dates is put in order afterwards
+    activity_dates = activity_elem.findall("activity-date")
+    if len(activity_dates) > 1:
+        first_index = activity_elem.index(activity_dates[0])
+        activity_elem[first_index:first_index + len(activity_dates)] = sorted(activity_dates, key=iati_order)
 
-def melt_iati(root):
-    activities_list_static = []
-    activities_list_additions = []
-    transactions_list = []
-    budgets_list = []
-    activities = root.getchildren()
-    for activity in activities:
-        activity_dict = recursive_tree_traversal(activity, "iati-activity", {})
-        activity_dict_static = {k: v for k, v in activity_dict.items() if create_ancestor_tag(k) not in ADDITIONAL_TAGS or create_ancestor_tag(k) == "iati-activity/iati-identifier"}
-        activity_dict_additions = {k: v for k, v in activity_dict.items() if create_ancestor_tag(k) in ADDITIONAL_TAGS}
-        for default_col, default_val in DEFAULT_ADDITIONAL_COLUMNS:
-            if default_col not in activity_dict_additions.keys():
-                activity_dict_additions[default_col] = default_val
-        activities_list_static.append(activity_dict_static)
-        activities_list_additions.append(activity_dict_additions)
-
-        # To key transactions and budgets
-        activity_id = activity_dict["iati-activity/iati-identifier[1]"]
-
-        transactions = activity.xpath("transaction")
-        for transaction in transactions:
-            transaction_dict = recursive_tree_traversal(transaction, "transaction", {})
-            transaction_dict["iati-activity/iati-identifier[1]"] = activity_id
-            transactions_list.append(transaction_dict)
-
-        budgets = activity.xpath("budget")
-        for budget in budgets:
-            budget_dict = recursive_tree_traversal(budget, "budget", {})
-            budget_dict["iati-activity/iati-identifier[1]"] = activity_id
-            budgets_list.append(budget_dict)
-
-    return (activities_list_static, activities_list_additions, transactions_list, budgets_list)
-
-
-def cast_iati(activities_list, transactions_list, budgets_list, iati_version="2.03"):
-    root = etree.Element('iati-activities', version=iati_version)
-    root.attrib["generated-datetime"] = datetime.datetime.now(pytz.utc).strftime('%Y-%m-%dT%H:%M:%S')
-    doc = etree.ElementTree(root)
 
-    activity_elems = {}
-    for activity in activities_list:
-        activity_id = activity["iati-activity/iati-identifier[1]"]
-        activity_elem = etree.SubElement(root, 'iati-activity')
-        activity_elem.attrib['{http://www.w3.org/XML/1998/namespace}lang'] = "en"
-        activity_elems[activity_id] = activity_elem
-        activity_filtered = OrderedDict((k[len('iati-activity')+1:], v) for k, v in activity.items() if v != "" and k[len('iati-activity'):len('iati-activity')+1] != ATTRIB_SEPERATOR)
-        for xpath_key in activity_filtered.keys():  # Once through first to create the elements in the correct order
-            xpath_without_attribute = xpath_key.split(ATTRIB_SEPERATOR)[0]
-            xpath_query = activity_elem.xpath(xpath_without_attribute)
-            parent_elem = activity_elem
-            xpath_split = xpath_without_attribute.split(XPATH_SEPERATOR)
-            creation_index = 0
-            while not xpath_query:
-                parent_elem_xpath_query = parent_elem.xpath(xpath_split[creation_index])
-                if parent_elem_xpath_query:
-                    parent_elem = parent_elem_xpath_query[0]
-                    creation_index += 1
-                    continue
-                child_elem_tag = remove_xpath_index(xpath_split[creation_index])
-                parent_elem = etree.SubElement(parent_elem, child_elem_tag)
-                creation_index += 1
-                xpath_query = activity_elem.xpath(xpath_without_attribute)
-        activity_attributes = OrderedDict((k[len('iati-activity')+1:], v) for k, v in activity.items() if v != "" and k[len('iati-activity'):len('iati-activity')+1] == ATTRIB_SEPERATOR)
-        for activity_attribute_key in activity_attributes.keys():  # Attributes applied to top level activity
-            activity_attribute_value = activity_attributes[activity_attribute_key]
-            activity_elem.attrib[activity_attribute_key] = activity_attribute_value
-        for child_elem_xpath in activity_filtered:  # Apply text and attribute values to child elements
-            child_elem_value = activity_filtered[child_elem_xpath]
-            if ATTRIB_SEPERATOR not in child_elem_xpath:
-                child_elem = activity_elem.xpath(child_elem_xpath)[0]
-                child_elem.text = child_elem_value
-            else:
-                child_xpath_without_attribute, child_attribute_key = child_elem_xpath.split(ATTRIB_SEPERATOR)
-                child_elem = activity_elem.xpath(child_xpath_without_attribute)[0]
-                child_elem.attrib[child_attribute_key] = child_elem_value
+def trie_element(element_trie, steps):
+    child_elem = element_trie.get(steps)
+    if child_elem is None:
+        parent_elem = trie_element(element_trie, steps[:-1])
+        child_elem = insert_child(parent_elem, steps[-1][0])
+        element_trie[steps] = child_elem
+    return child_elem
 
-    for transaction in transactions_list:
-        activity_id = transaction["iati-activity/iati-identifier[1]"]
-        try:
-            activity_elem = activity_elems[activity_id]
-        except KeyError:
+
+def cast_record(record_elem, record, column_plan):
+    # Elements are created in column plan order, so same-tag siblings are created in index order
+    element_trie = {(): record_elem}
+    for column_key, steps, attribute_key in column_plan:
+        record_value = record.get(column_key, "")
+        if record_value == "":
             continue
-        transaction_elem = etree.SubElement(activity_elem, 'transaction')
-        transaction_filtered = OrderedDict((k[len('transaction')+1:], v) for k, v in transaction.items() if v != "" and k[len('transaction'):len('transaction')+1] != ATTRIB_SEPERATOR and k != "iati-activity/iati-identifier[1]")
-        for xpath_key in transaction_filtered.keys():  # Once through first to create the elements in the correct order
-            xpath_without_attribute = xpath_key.split(ATTRIB_SEPERATOR)[0]
-            xpath_query = transaction_elem.xpath(xpath_without_attribute)
-            parent_elem = transaction_elem
-            xpath_split = xpath_without_attribute.split(XPATH_SEPERATOR)
-            creation_index = 0
-            while not xpath_query:
-                parent_elem_xpath_query = parent_elem.xpath(xpath_split[creation_index])
-                if parent_elem_xpath_query:
-                    parent_elem = parent_elem_xpath_query[0]
-                    creation_index += 1
-                    continue
-                child_elem_tag = remove_xpath_index(xpath_split[creation_index])
-                parent_elem = etree.SubElement(parent_elem, child_elem_tag)
-                creation_index += 1
-                xpath_query = transaction_elem.xpath(xpath_without_attribute)
-        transaction_attributes = OrderedDict((k[len('transaction')+1:], v) for k, v in transaction.items() if v != "" and k[len('transaction'):len('transaction')+1] == ATTRIB_SEPERATOR)
-        for transaction_attribute_key in transaction_attributes.keys():  # Attributes applied to top level transaction
-            transaction_attribute_value = transaction_attributes[transaction_attribute_key]
-            transaction_elem.attrib[transaction_attribute_key] = transaction_attribute_value
-        for child_elem_xpath in transaction_filtered:  # Apply text and attribute values to child elements
-            child_elem_value = transaction_filtered[child_elem_xpath]
-            if ATTRIB_SEPERATOR not in child_elem_xpath:
-                child_elem = transaction_elem.xpath(child_elem_xpath)[0]
-                child_elem.text = child_elem_value
-            else:
-                child_xpath_without_attribute, child_attribute_key = child_elem_xpath.split(ATTRIB_SEPERATOR)
-                child_elem = transaction_elem.xpath(child_xpath_without_attribute)[0]
-                child_elem.attrib[child_attribute_key] = child_elem_value
+        child_elem = trie_element(element_trie, steps)
+        if attribute_key:
+            child_elem.attrib[attribute_key] = record_value
+        else:
+            child_elem.text = record_value
+
+
+def cast_child_record(activity_elem, record, record_tag, column_plan):
+    record_elem = insert_child(activity_elem, record_tag)
+    cast_record(record_elem, record, column_plan)
+    complete_element(record_elem, ("iati-activities", "iati-activity"))
 
-    for budget in budgets_list:
-        activity_id = budget["iati-activity/iati-identifier[1]"]
+
+def cast_child_records(activity_elems, records_list, record_tag):
+    # Casts a table keyed on iati-activity/iati-identifier[1] (transactions, budgets) into its activities
+    column_plan = compile_column_plan(table_columns(records_list), record_tag)
+    for record in records_list:
+        activity_id = record["iati-activity/iati-identifier[1]"]
         try:
             activity_elem = activity_elems[activity_id]
         except KeyError:
             continue
-        budget_elem = etree.SubElement(activity_elem, 'budget')
-        budget_filtered = OrderedDict((k[len('budget')+1:], v) for k, v in budget.items() if v != "" and k[len('budget'):len('budget')+1] != ATTRIB_SEPERATOR and k != "iati-activity/iati-identifier[1]")
-        for xpath_key in budget_filtered.keys():  # Once through first to create the elements in the correct order
-            xpath_without_attribute = xpath_key.split(ATTRIB_SEPERATOR)[0]
-            xpath_query = budget_elem.xpath(xpath_without_attribute)
-            parent_elem = budget_elem
-            xpath_split = xpath_without_attribute.split(XPATH_SEPERATOR)
-            creation_index = 0
-            while not xpath_query:
-                parent_elem_xpath_query = parent_elem.xpath(xpath_split[creation_index])
-                if parent_elem_xpath_query:
-                    parent_elem = parent_elem_xpath_query[0]
-                    creation_index += 1
-                    continue
-                child_elem_tag = remove_xpath_index(xpath_split[creation_index])
-                parent_elem = etree.SubElement(parent_elem, child_elem_tag)
-                creation_index += 1
-                xpath_query = budget_elem.xpath(xpath_without_attribute)
-        budget_attributes = OrderedDict((k[len('budget')+1:], v) for k, v in budget.items() if v != "" and k[len('budget'):len('budget')+1] == ATTRIB_SEPERATOR)
-        for budget_attribute_key in budget_attributes.keys():  # Attributes applied to top level budget
-            budget_attribute_value = budget_attributes[budget_attribute_key]
-            budget_elem.attrib[budget_attribute_key] = budget_attribute_value
-        for child_elem_xpath in budget_filtered:  # Apply text and attribute values to child elements
-            child_elem_value = budget_filtered[child_elem_xpath]
-            if ATTRIB_SEPERATOR not in child_elem_xpath:
-                child_elem = budget_elem.xpath(child_elem_xpath)[0]
-                child_elem.text = child_elem_value
-            else:
-                child_xpath_without_attribute, child_attribute_key = child_elem_xpath.split(ATTRIB_SEPERATOR)
-                child_elem = budget_elem.xpath(child_xpath_without_attribute)[0]
-                child_elem.attrib[child_attribute_key] = child_elem_value
-
-    # Add missing mandatory elements
-    for required_child in REQUIRED_CHILDREN:
-        parent_xpath, child_tag = required_child
-        matching_parents = doc.xpath(parent_xpath)
-        for matching_parent in matching_parents:
-            child_query = matching_parent.xpath(child_tag)
-            if not child_query:
-                etree.SubElement(matching_parent, child_tag)
-
-    # Add missing mandatory attributes
-    for required_attrib in REQUIRED_ATTRIBUTES:
-        parent_xpath, attrib_key = required_attrib
-        matching_parents = doc.xpath(parent_xpath)
-        for matching_parent in matching_parents:
-            if attrib_key not in matching_parent.attrib:
-                matching_parent.attrib[attrib_key] = ""
-
-    # Enforce IATI order
-    for parent in doc.xpath('//*[./*]'):  # Search for parent elements, reorder
-        parent[:] = sorted(parent, key=lambda x: iati_order(x))
+        cast_child_record(activity_elem, record, record_tag, column_plan)
+
+
+def cast_activity(root, activity, activity_plan):
+    activity_elem = etree.SubElement(root, 'iati-activity')
+    activity_elem.attrib['{http://www.w3.org/XML/1998/namespace}lang'] = "en"
+    cast_record(activity_elem, activity, activity_plan)
+    order_activity_dates(activity_elem)
+    complete_element(activity_elem, ("iati-activities",))
+    return activity_elem
+
+
+def cast_activities(root, activities_list, transactions_list, budgets_list):
+    activity_elems = {}
+    activity_plan = compile_column_plan(table_columns(activities_list), 'iati-activity')
+    for activity_index, activity in enumerate(activities_list):
+        report_progress("Building activities", activity_index, len(activities_list))
+        activity_elems[activity["iati-activity/iati-identifier[1]"]] = cast_activity(root, activity, activity_plan)
+
+    # Budgets sort before transactions, so casting them first keeps each insertion near the end of its activity
+    for records_list, record_tag in [(budgets_list, 'budget'), (transactions_list, 'transaction')]:
+        cast_child_records(activity_elems, records_list, record_tag)
+
+
+def partition_records(activities_list, transactions_list, budgets_list, chunk_count):
+    # Contiguous chunks of activities, each with the transactions and budgets it will own
+    chunk_size = -(-len(activities_list) // chunk_count)
+    chunks = [([], [], []) for _ in range(-(-len(activities_list) // chunk_size))]
+    activity_chunks = {}
+    for activity_index, activity in enumerate(activities_list):
+        chunks[activity_index // chunk_size][0].append(activity)
+        activity_chunks[activity["iati-activity/iati-identifier[1]"]] = activity_index // chunk_size  # Last one wins, as in cast_activities
+    for records_index, records_list in [(1, transactions_list), (2, budgets_list)]:
+        for record in records_list:
+            chunk_index = activity_chunks.get(record["iati-activity/iati-identifier[1]"])
+            if chunk_index is not None:
+                chunks[chunk_index][records_index].append(record)
+    return chunks
+
+
+def cast_activity_chunk(chunk):
+    # Process pool worker: builds a chunk of activities, returned serialised
+    activities_list, transactions_list, budgets_list = chunk
+    chunk_root = etree.Element('iati-activities')
+    cast_activities(chunk_root, activities_list, transactions_list, budgets_list)
+    return etree.tostring(chunk_root)
+
+
+def new_iati_root(iati_version):
+    root = etree.Element('iati-activities', version=iati_version)
+    root.attrib["generated-datetime"] = datetime.datetime.now(pytz.utc).strftime('%Y-%m-%dT%H:%M:%S')
+    return root
+
+
+def iter_cast_chunks(activities_list, transactions_list, budgets_list, workers):
+    # Activities built by a pool of workers, in order
+    chunks = deque(partition_records(activities_list, transactions_list, budgets_list, workers * CHUNKS_PER_WORKER))
+    activity_count = 0
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        pending_results = deque()
+        try:
+            while chunks or pending_results:
+                while chunks and len(pending_results) < workers * CAST_CHUNKS_QUEUED_PER_WORKER:  # Submitted as results are taken, so a cancel need not wait for them all
+                    pending_results.append(executor.submit(cast_activity_chunk, chunks.popleft()))
+                for activity_elem in list(etree.fromstring(pending_results.popleft().result())):
+                    yield activity_elem
+                    activity_count += 1
+                report_progress("Building activities", activity_count, len(activities_list))
+        finally:  # On cancel, or when the caller stops early, chunks not yet started are dropped
+            for pending_result in pending_results:
+                pending_result.cancel()
+
+
+def cast_iati(activities_list, transactions_list, budgets_list, iati_version="2.03", workers=1):
+    root = new_iati_root(iati_version)
+    doc = etree.ElementTree(root)
+
+    if workers > 1 and activities_list:
+        root.extend(iter_cast_chunks(activities_list, transactions_list, budgets_list, workers))
+        return doc
+
+    cast_activities(root, activities_list, transactions_list, budgets_list)
+    if not len(root):  # Still a mandatory, empty, activity
+        complete_element(root)
     return doc
 
 
-def xml_to_csv(xml_filename, csv_dir=None):
+def iter_activity_bundles(activities, transactions, budgets):
+    # Merge-joins tables sorted on identifier into (activity, its transactions, its budgets), one activity at a time
+    record_iters = [iter(transactions), iter(budgets)]
+    pending_records = [next(record_iter, None) for record_iter in record_iters]
+    activities = iter(activities)
+    activity = next(activities, None)
+    while activity is not None:
+        next_activity = next(activities, None)
+        activity_id = activity["iati-activity/iati-identifier[1]"]
+        bundle = (activity, [], [])
+        # An identifier repeated across activities gives its records to the last of them, as in cast_activities
+        if next_activity is None or next_activity["iati-activity/iati-identifier[1]"] != activity_id:
+            for table_index, record_iter in enumerate(record_iters):
+                record = pending_records[table_index]
+                while record is not None and record["iati-activity/iati-identifier[1]"] <= activity_id:
+                    if record["iati-activity/iati-identifier[1]"] == activity_id:
+                        bundle[table_index + 1].append(record)
+                    record = next(record_iter, None)  # Records of no activity are dropped, as in cast_child_records
+                pending_records[table_index] = record
+        yield bundle
+        activity = next_activity
+
+
+def iter_bundle_activities(bundles, activity_columns, transaction_columns, budget_columns, activity_count=0):
+    # Builds activities one at a time from iter_activity_bundles, each as cast_iati would, and yields them detached
+    scratch_root = etree.Element('iati-activities')
+    activity_plan = compile_column_plan(activity_columns, 'iati-activity')
+    transaction_plan = compile_column_plan(transaction_columns, 'transaction')
+    budget_plan = compile_column_plan(budget_columns, 'budget')
+    for activity_index, (activity, activity_transactions, activity_budgets) in enumerate(bundles):
+        report_progress("Building activities", activity_index, activity_count)
+        activity_elem = cast_activity(scratch_root, activity, activity_plan)
+        scratch_root.remove(activity_elem)
+        for budget in activity_budgets:
+            cast_child_record(activity_elem, budget, 'budget', budget_plan)
+        for transaction in activity_transactions:
+            cast_child_record(activity_elem, transaction, 'transaction', transaction_plan)
+        yield activity_elem
+
+
+@contextlib.contextmanager
+def replaced_on_success(filename):
+    # Yields a temporary file beside filename, which replaces it only if the block finishes, so a cancelled or failed write
+    # leaves the previous file as it was
+    temporary_filename = "{}.{}.tmp".format(filename, os.getpid())  # Opened as the output would be, so it gets the same permissions
+    try:
+        with open(temporary_filename, "wb") as output_file:
+            yield output_file
+        os.replace(temporary_filename, filename)
+    finally:
+        if os.path.exists(temporary_filename):
+            os.remove(temporary_filename)
+
+
+def write_iati_stream(xml_filename, activity_elems, iati_version="2.03"):
+    # Writes each activity as soon as it is built and lets it go, so memory is bounded by the largest activity rather than
+    # the document. The bytes are those csv_to_xml writes for the whole document, as each activity is pretty printed at its
+    # own depth inside a copy of the root, and only the root's tags are written once.
+    root = new_iati_root(iati_version)
+    root_end_tag = b"</iati-activities>\n"
+    activity_count = 0
+    with replaced_on_success(xml_filename) as xmlfile:
+        for activity_elem in activity_elems:
+            root.append(activity_elem)
+            activity_bytes = etree.tostring(root, encoding="utf-8", pretty_print=True)
+            root.remove(activity_elem)
+            start_tag_end = activity_bytes.index(b"\n") + 1
+            if not activity_count:
+                xmlfile.write(activity_bytes[:start_tag_end])
+            xmlfile.write(activity_bytes[start_tag_end:-len(root_end_tag)])
+            activity_count += 1
+        if activity_count:
+            xmlfile.write(root_end_tag)
+        else:  # Still a mandatory, empty, activity
+            complete_element(root)
+            xmlfile.write(etree.tostring(root, encoding="utf-8", pretty_print=True))
+    return activity_count
+
+
+def rule_path(xpath):
+    # "//sector" -> ((), "sector"), "iati-activity/reporting-org/narrative" -> (("iati-activity", "reporting-org"), "narrative")
+    path_tags = xpath.lstrip(XPATH_SEPERATOR).split(XPATH_SEPERATOR)
+    return tuple(path_tags[:-1]), path_tags[-1]
+
+
+def compile_element_rules(with_defaults):
+    # Dispatch table of tag -> [(kind, ancestor tags, name, value)], each kind in the order its table was applied by a document-wide pass
+    element_rules = {}
+    for parent_xpath, child_tag in REQUIRED_CHILDREN:
+        ancestor_tags, elem_tag = rule_path(parent_xpath)
+        element_rules.setdefault(elem_tag, []).append(("child", ancestor_tags, child_tag, None))
+    for elem_xpath, attrib_key in REQUIRED_ATTRIBUTES:
+        ancestor_tags, elem_tag = rule_path(elem_xpath)
+        element_rules.setdefault(elem_tag, []).append(("attribute", ancestor_tags, attrib_key, ""))
+    if with_defaults:
+        for elem_xpath, default_value in DEFAULT_ELEM_VALS:
+            ancestor_tags, elem_tag = rule_path(elem_xpath)
+            element_rules.setdefault(elem_tag, []).append(("default-text", ancestor_tags, None, default_value))
+        for elem_xpath, attrib_key, default_value in DEFAULT_ATTRIBS:
+            ancestor_tags, elem_tag = rule_path(elem_xpath)
+            element_rules.setdefault(elem_tag, []).append(("default-attribute", ancestor_tags, attrib_key, default_value))
+    return element_rules
+
+
+NORMALISE_RULES = compile_element_rules(with_defaults=True)
+COMPLETE_RULES = compile_element_rules(with_defaults=False)
+
+
+def apply_element_rules(element, element_rules, ancestor_tags=(), sort_children=True):
+    # One depth-first walk: each element gets its rules applied, then its children are put in IATI order and walked
+    for rule_kind, rule_ancestor_tags, rule_name, rule_value in element_rules.get(element.tag, ()):
+        if rule_ancestor_tags and ancestor_tags[-len(rule_ancestor_tags):] != rule_ancestor_tags:
+            continue
+        if rule_kind == "child":
+            if element.find(rule_name) is None:
+                insert_child(element, rule_name)
+        elif rule_kind == "attribute":
+            if rule_name not in element.attrib:
+                element.attrib[rule_name] = rule_value
+        elif rule_kind == "default-text":
+            if not element.text:
+                element.text = rule_value
+        elif not element.get(rule_name):
+            element.attrib[rule_name] = rule_value
+
+    if len(element):
+        children = list(element)
+        if sort_children:
+            ordered_children = sorted(children, key=iati_order)  # IATI order, also activity-date@type
+            if ordered_children != children:
+                element[:] = ordered_children
+                children = ordered_children
+        child_ancestor_tags = ancestor_tags + (element.tag,)
+        for child_elem in children:
+            apply_element_rules(child_elem, element_rules, child_ancestor_tags, sort_children)
+
+
+def normalise_element(element):
+    # Prepares parsed XML for melting
+    apply_element_rules(element, NORMALISE_RULES)
+
+
+def complete_element(element, ancestor_tags=()):
+    # Adds required children and attributes to XML that cast_iati has built in IATI order
+    apply_element_rules(element, COMPLETE_RULES, ancestor_tags, sort_children=False)
+
+
+def iter_activities(xml_filename):
+    context = etree.iterparse(xml_filename, events=("end",), tag="iati-activity", remove_blank_text=True)
+    for _, activity in context:
+        yield activity
+        activity.clear()  # Free the finished activity and any already processed siblings
+        while activity.getprevious() is not None:
+            del activity.getparent()[0]
+    del context
+
+
+def melted_to_csv(melt_table, csv_filename):
+    with trace_stage("build-frame") as frame_stage:
+        melted_df = melt_table.to_frame()
+        frame_stage.items = len(melted_df)
+    with trace_stage("sort"):
+        melted_df = melted_df.reindex(sorted(melted_df.columns, key=iati_order_xpath), axis=1).sort_values('iati-activity/iati-identifier[1]', kind="mergesort")
+    with trace_stage("write-csv") as write_stage:
+        melted_df.to_csv(csv_filename, index=False)
+        write_stage.items = len(melted_df)
+
+
+class MeltSpool(object):
+    # Melted rows pickled to a temporary file, so only their identifiers and offsets stay in memory
+    def __init__(self):
+        self.spool_file = tempfile.TemporaryFile()
+        self.columns = set()
+        self.activity_ids = []
+        self.spool_offsets = []
+
+    def append(self, melted_dict):
+        self.activity_ids.append(melted_dict["iati-activity/iati-identifier[1]"])
+        self.spool_offsets.append(self.spool_file.tell())
+        self.columns.update(melted_dict.keys())
+        pickle.dump(melted_dict, self.spool_file, pickle.HIGHEST_PROTOCOL)
+
+    def extend(self, melt_table):
+        for melted_dict in melt_table.records():
+            self.append(melted_dict)
+
+    def ordered_records(self, row_order):
+        for row_index in row_order:
+            self.spool_file.seek(self.spool_offsets[row_index])
+            yield pickle.load(self.spool_file)
+
+    def to_csv(self, csv_filename):
+        columns = sorted(self.columns, key=iati_order_xpath)
+        # Sort the identifiers as the in-memory DataFrame.sort_values does, stably, so an activity's rows keep their order
+        row_order = pd.Series(self.activity_ids, dtype=str).sort_values(kind="mergesort").index
+        with open(csv_filename, "w", newline="", encoding="utf-8") as csvfile:
+            for chunk_start in range(0, max(len(row_order), 1), STREAM_CHUNK_SIZE):
+                melted_list = list(self.ordered_records(row_order[chunk_start:chunk_start + STREAM_CHUNK_SIZE]))
+                melted_df = pd.DataFrame(melted_list, columns=columns, dtype=str)
+                melted_df.to_csv(csvfile, header=(chunk_start == 0), index=False)
+
+    def to_sqlite(self, connection, table_name):
+        columns = sorted(self.columns, key=iati_order_xpath)
+        write_sqlite_table(connection, table_name, columns, self.ordered_records(csv_row_order(self.activity_ids)))
+
+    def close(self):
+        self.spool_file.close()
+
+
+def iter_validation_chunks(xml_source, chunk_size):
+    # Runs of activities, each wrapped in a copy of the document's iati-activities root
+    chunk_root = None
+    for activity in iter_activities(xml_source):
+        if chunk_root is None:
+            source_root = activity.getparent()
+            chunk_root = etree.Element(source_root.tag, attrib=dict(source_root.attrib), nsmap=source_root.nsmap)
+        chunk_root.append(copy.deepcopy(activity))
+        if len(chunk_root) == chunk_size:
+            yield etree.tostring(chunk_root, encoding="unicode", pretty_print=True)
+            chunk_root = None
+    if chunk_root is not None:
+        yield etree.tostring(chunk_root, encoding="unicode", pretty_print=True)
+
+
+def error_record(err_rec, activity_id=""):
+    return OrderedDict([("info", err_rec.info), ("description", err_rec.description), ("status", err_rec.status), ("category", err_rec.category), ("iati-activity/iati-identifier[1]", activity_id)])
+
+
+def validate_chunk(chunk_xml):
+    # Process pool worker: validates one chunk, attributing errors to activities by line or by rechecking failed rules
+    dataset = iati.Dataset(chunk_xml)
+    activities = list(dataset.xml_tree.getroot().iterchildren("iati-activity"))
+    activity_lines = [activity.sourceline for activity in activities]
+    activity_ids = [activity.findtext("iati-identifier") or "" for activity in activities]
+    error_log = iati.validator.full_validation(dataset, get_v203_schema())
+    failed_rules = OrderedDict((err_rec.info, err_rec) for err_rec in error_log if err_rec.category == "rule" and err_rec.status == "error")
+
+    located_records = []
+    unlocated_records = []
+    for err_rec in error_log:
+        if err_rec.category == "rule" and err_rec.status == "error":
+            continue
+        line_number = getattr(err_rec, "line_number", None)
+        activity_index = bisect.bisect_right(activity_lines, line_number) - 1 if line_number else -1
+        if activity_index >= 0:
+            located_records.append(error_record(err_rec, activity_ids[activity_index]))
+        else:
+            unlocated_records.append(error_record(err_rec))
+
+    for activity, activity_id in zip(activities, activity_ids) if failed_rules else []:
+        activity_root = etree.Element(dataset.xml_tree.getroot().tag, attrib=dict(dataset.xml_tree.getroot().attrib))
+        activity_root.append(copy.deepcopy(activity))
+        activity_dataset = iati.Dataset(activity_root)
+        for ruleset in get_v203_schema().rulesets:
+            for rule in ruleset.rules:
+                if str(rule) not in failed_rules:
+                    continue
+                try:
+                    rule_valid = rule.is_valid_for(activity_dataset)
+                except ValueError:
+                    rule_valid = False
+                if rule_valid is False:
+                    located_records.append(error_record(failed_rules[str(rule)], activity_id))
+    return located_records, unlocated_records
+
+
+def chunked_validation(xml_source, workers=1, chunk_size=VALIDATION_CHUNK_SIZE):
+    # Chunks are made as they are needed, at most a few per worker waiting, so memory is bounded by the window, not the document
+    error_records = []
+    unlocated_records = []
+    chunk_count = 0
+
+    def add_chunk_result(chunk_result):
+        located_records, chunk_unlocated_records = chunk_result
+        error_records.extend(located_records)
+        for unlocated_record in chunk_unlocated_records:  # Document level errors, such as the ruleset failure, once each
+            if unlocated_record not in unlocated_records:
+                unlocated_records.append(unlocated_record)
+        report_progress("Validating activities", chunk_count * chunk_size)
+
+    if workers > 1:
+        with ProcessPoolExecutor(max_workers=workers) as executor:
+            pending_results = deque()
+            for chunk_xml in iter_validation_chunks(xml_source, chunk_size):
+                pending_results.append(executor.submit(validate_chunk, chunk_xml))
+                if len(pending_results) >= workers * VALIDATION_CHUNKS_PER_WORKER:
+                    chunk_count += 1
+                    add_chunk_result(pending_results.popleft().result())
+            while pending_results:
+                chunk_count += 1
+                add_chunk_result(pending_results.popleft().result())
+    else:
+        for chunk_xml in iter_validation_chunks(xml_source, chunk_size):
+            chunk_count += 1
+            add_chunk_result(validate_chunk(chunk_xml))
+    if not chunk_count:
+        return None
+    error_records.extend(unlocated_records)
+    return error_records
+
+
+def validate_dataset(dataset):
+    # One full validation pass, from which every reported check is derived
+    return [error_record(err_rec) for err_rec in iati.validator.full_validation(dataset, get_v203_schema())]
+
+
+def report_validation(error_records, errors_filename, label, error_columns, xml_valid):
+    iati_valid = not any(err_rec["status"] == "error" and err_rec["category"] in SCHEMA_ERROR_CATEGORIES for err_rec in error_records)
+    fully_valid = not any(err_rec["status"] == "error" for err_rec in error_records)
+    print("{} is valid XML: {}".format(label, xml_valid))
+    print("{} is valid IATI: {}".format(label, iati_valid))
+    print("{} has valid IATI schema and rules: {}".format(label, fully_valid))
+    if not fully_valid:
+        print("Writing {} validation error CSV... Done.".format(label.lower()))
+        pd.DataFrame(error_records, columns=error_columns).to_csv(errors_filename)
+    elif os.path.exists(errors_filename):  # Left by an earlier run, it no longer describes the document
+        os.remove(errors_filename)
+    return OrderedDict([
+        ("valid-xml", xml_valid),
+        ("valid-iati", iati_valid),
+        ("valid-schema-and-rules", fully_valid),
+        ("errors", len([err_rec for err_rec in error_records if err_rec["status"] == "error"])),
+    ])
+
+
+def not_xml_record(syntax_error):
+    return OrderedDict([("info", str(syntax_error)), ("description", "The document is not well-formed XML."), ("status", "error"), ("category", "xml"), ("iati-activity/iati-identifier[1]", "")])
+
+
+def validation_error_records(xml_filename, validation_workers=None, xml_bytes=None):
+    # The error records, their report columns and whether the document parsed; only records validated in chunks are attributed to activities
+    # xml_bytes, when the caller has just serialised the document, saves reading it back from disk
+    if validation_workers is not None:
+        try:
+            error_records = chunked_validation(io.BytesIO(xml_bytes) if xml_bytes is not None else xml_filename, validation_workers)
+        except etree.XMLSyntaxError as syntax_error:
+            return [not_xml_record(syntax_error)], VALIDATION_ERROR_COLUMNS, False
+        if error_records is not None:  # Otherwise there are no activities to chunk
+            return error_records, VALIDATION_ERROR_COLUMNS, True
+
+    report_progress("Validating", 0)
+    try:
+        if xml_bytes is not None:
+            dataset = iati.Dataset(xml_bytes.decode("utf-8"))
+        else:
+            dataset = iati.utilities.load_as_dataset(xml_filename)
+    except iati.exceptions.ValidationError as not_xml_error:  # pyIATI's parse errors
+        return [error_record(err_rec) for err_rec in not_xml_error.error_log], ["info", "description", "status"], False
+    return validate_dataset(dataset), ["info", "description", "status"], True
+
+
+def validate_xml(xml_filename, errors_filename, label, validation_workers=None, xml_bytes=None):
+    error_records, error_columns, xml_valid = validation_error_records(xml_filename, validation_workers, xml_bytes)
+    return report_validation(error_records, errors_filename, label, error_columns, xml_valid)
+
+
+def conversion_summary(activity_count, transaction_count, budget_count, validation, extra_counts=()):
+    # What a conversion handled, for batch reports
+    return OrderedDict([("activities", activity_count), ("transactions", transaction_count), ("budgets", budget_count)] + list(extra_counts) + [("validation", validation)])
+
+
+def read_melted_csv(csv_filename):
+    try:
+        return pd.read_csv(csv_filename, dtype=str, keep_default_na=False)
+    except pd.errors.EmptyDataError:  # No rows were melted into it
+        return pd.DataFrame(columns=["iati-activity/iati-identifier[1]"], dtype=str)
+
+
+def update_csv_dir(xml_filename, csv_filenames, manifest_filename, errors_filename, validation_workers=None):
+    # Re-melts only activities new to, or changed since, the publication the CSVs were converted from; None if that can't be done
+    with trace_stage("parse") as parse_stage:
+        root = etree.parse(xml_filename, etree.XMLParser(remove_blank_text=True)).getroot()
+        activities = index_activities(root)
+        parse_stage.items = len(activities)
+    if len(activities) != len(root.findall("iati-activity")):  # Rows could not be matched to a single activity
+        return None
+    with trace_stage("fingerprint") as fingerprint_stage:
+        fingerprints = fingerprint_activities(activities)
+        past_fingerprints, past_error_records = read_source_manifest(manifest_filename) if os.path.exists(manifest_filename) else ({}, None)
+        fingerprint_stage.items = len(fingerprints)
+
+    with trace_stage("read-csv") as read_stage:
+        csv_dfs = [read_melted_csv(csv_filename) for csv_filename in csv_filenames]
+        read_stage.items = sum(len(csv_df) for csv_df in csv_dfs)
+    held_ids = set(csv_dfs[0]["iati-activity/iati-identifier[1]"]) | set(csv_dfs[1]["iati-activity/iati-identifier[1]"])
+    changed_ids = [activity_id for activity_id, fingerprint in fingerprints.items() if activity_id not in held_ids or past_fingerprints.get(activity_id) != fingerprint]
+    removed_ids = held_ids.difference(fingerprints.keys())
+    print("{} new or changed activities, {} unchanged activities, {} removed activities".format(len(changed_ids), len(activities) - len(changed_ids), len(removed_ids)))
+
+    # The errors of unchanged activities are kept from the manifest, unless it has none attributed to activities
+    validated_ids = changed_ids if past_error_records is not None else list(activities.keys())
+    past_records = {}
+    for err_rec in past_error_records or []:
+        past_records.setdefault(err_rec["iati-activity/iati-identifier[1]"], []).append(err_rec)
+    validated_records = {}
+    if validated_ids:
+        with trace_stage("validate") as validate_stage:
+            validated_root = etree.Element(root.tag, attrib=dict(root.attrib), nsmap=root.nsmap)
+            validated_root.extend(copy.deepcopy(activities[activity_id]) for activity_id in validated_ids)
+            for err_rec in chunked_validation(io.BytesIO(etree.tostring(validated_root, encoding="utf-8", pretty_print=True)), validation_workers or 1):
+                validated_records.setdefault(err_rec["iati-activity/iati-identifier[1]"], []).append(err_rec)
+            validate_stage.items = len(validated_ids)
+    validated_id_set = set(validated_ids)
+    error_records = []
+    for activity_id in activities:
+        error_records.extend(validated_records.get(activity_id, []) if activity_id in validated_id_set else past_records.get(activity_id, []))
+    for err_rec in past_records.get("", []) + validated_records.get("", []):  # Document level errors, once each
+        if err_rec not in error_records:
+            error_records.append(err_rec)
+    validation = report_validation(error_records, errors_filename, "Input", VALIDATION_ERROR_COLUMNS, True)  # Parsed above
+
+    melt_tables = (MeltTable(), MeltTable(), MeltTable(), MeltTable())
+    if changed_ids or removed_ids:
+        with trace_stage("melt") as melt_stage:
+            for activity_index, activity_id in enumerate(changed_ids):
+                normalise_element(activities[activity_id])
+                melt_activity(activities[activity_id], *melt_tables)
+                report_progress("Melting activities", activity_index + 1, len(changed_ids))
+            melt_stage.items = len(changed_ids)
+        replaced_ids = removed_ids.union(changed_ids)
+        for csv_filename, csv_df, melt_table in zip(csv_filenames, csv_dfs, melt_tables):
+            with trace_stage("build-frame") as frame_stage:
+                melted_df = melt_table.to_frame()
+                # Existing columns keep their place, any new ones follow in IATI order
+                columns = list(csv_df.columns) + sorted([column for column in melted_df.columns if column not in csv_df.columns], key=iati_order_xpath)
+                kept_df = csv_df[~csv_df["iati-activity/iati-identifier[1]"].isin(replaced_ids)]
+                updated_df = pd.concat([kept_df, melted_df], ignore_index=True).reindex(columns=columns)
+                frame_stage.items = len(updated_df)
+            with trace_stage("sort"):
+                updated_df = updated_df.sort_values("iati-activity/iati-identifier[1]", kind="mergesort")
+            with trace_stage("write-csv") as write_stage:
+                updated_df.to_csv(csv_filename, index=False)
+                write_stage.items = len(updated_df)
+
+    write_fingerprint_manifest(manifest_filename, fingerprints, error_records=error_records)
+    return conversion_summary(len(melt_tables[0]), len(melt_tables[2]), len(melt_tables[3]), validation,
+                              [("unchanged-activities", len(activities) - len(changed_ids)), ("removed-activities", len(removed_ids))])
+
+
+@traced_pipeline
+def xml_to_csv(xml_filename, csv_dir=None, streaming=False, validation_workers=None, update=False, sqlite=False):
     if not csv_dir:
         csv_dir = os.path.splitext(xml_filename)[0]
     if not os.path.exists(csv_dir):
         os.makedirs(csv_dir)
-    print("Converting IATI XML at '{}' to CSV in '{}'".format(xml_filename, csv_dir))
-
-    # Validate FocalPoint input
-    dataset = iati.utilities.load_as_dataset(xml_filename)
-    print("Input is valid XML: {}".format(iati.validator.is_xml(dataset)))
-    print("Input is valid IATI: {}".format(iati.validator.is_iati_xml(dataset, v203_schema)))
-    fully_valid = iati.validator.is_valid(dataset, v203_schema)
-    print("Input has valid IATI schema and rules: {}".format(fully_valid))
-    if not fully_valid:
-        print("Writing input validation error CSV... Done.")
-        error_log = iati.validator.full_validation(dataset, v203_schema)
-        error_records = [{"info": err_rec.info, "description": err_rec.description, "status": err_rec.status} for err_rec in error_log]
-        pd.DataFrame(error_records).to_csv(os.path.join(csv_dir, "input_validation_errors.csv"))
+    print("Converting IATI XML at '{}' to {} in '{}'".format(xml_filename, "SQLite" if sqlite else "CSV", csv_dir))
 
     a_filename = os.path.join(csv_dir, "activities_static.csv")
     a_add_filename = os.path.join(csv_dir, "activities_additions.csv")
     t_filename = os.path.join(csv_dir, "transactions.csv")
     b_filename = os.path.join(csv_dir, "budgets.csv")
+    errors_filename = os.path.join(csv_dir, "input_validation_errors.csv")
+    # Fingerprints of the source activities, so an update can tell which ones a later publication changed
+    manifest_filename = os.path.join(csv_dir, SOURCE_MANIFEST_BASENAME)
+    sqlite_filename = os.path.join(csv_dir, SQLITE_STORE_BASENAME)
+
+    if update and sqlite:
+        print("Only CSVs can be updated in place, converting in full")
+    elif update and all(os.path.exists(csv_filename) for csv_filename in [a_filename, a_add_filename, t_filename, b_filename]):
+        summary = update_csv_dir(xml_filename, [a_filename, a_add_filename, t_filename, b_filename], manifest_filename, errors_filename, validation_workers)
+        if summary is not None:
+            return summary
+        print("Activities with missing or repeated identifiers can't be updated in place, converting in full")
+
+    # Validate FocalPoint input, in chunks when streaming so the whole document is never loaded
+    if streaming and validation_workers is None:
+        validation_workers = 1
+    with trace_stage("validate") as validate_stage:
+        error_records, error_columns, xml_valid = validation_error_records(xml_filename, validation_workers)
+        validation = report_validation(error_records, errors_filename, "Input", error_columns, xml_valid)
+        validate_stage.items = validation["errors"]
+    # Errors attributed to activities are kept in the manifest, so an update need only revalidate the activities it melts
+    activity_error_records = error_records if error_columns == VALIDATION_ERROR_COLUMNS else None
+
+    if streaming:
+        melt_spools = (MeltSpool(), MeltSpool(), MeltSpool(), MeltSpool())
+        melt_tables = (MeltTable(), MeltTable(), MeltTable(), MeltTable())
+        fingerprints = OrderedDict()
+        activity_count = 0
+        with trace_stage("stream-melt") as melt_stage:  # Parsing, fingerprinting, normalising and melting interleave here
+            for activity in iter_activities(xml_filename):
+                iati_id = activity.find("iati-identifier")
+                if iati_id is not None and iati_id.text is not None and iati_id.text not in fingerprints:  # Keyed as index_activities would
+                    fingerprints[iati_id.text] = activity_fingerprint(activity)
+                normalise_element(activity)
+                melt_activity(activity, *melt_tables)
+                activity_count += 1
+                report_progress("Melting activities", activity_count)
+                if activity_count % STREAM_CHUNK_SIZE == 0:  # Spool each run of melted activities
+                    for melt_spool, melt_table in zip(melt_spools, melt_tables):
+                        melt_spool.extend(melt_table)
+                    melt_tables = (MeltTable(), MeltTable(), MeltTable(), MeltTable())
+            if not activity_count:  # Mirror the in-memory path, which adds an empty mandatory activity
+                root = etree.Element("iati-activities")
+                normalise_element(root)
+                melt_tables = melt_iati(root)
+            for melt_spool, melt_table in zip(melt_spools, melt_tables):
+                melt_spool.extend(melt_table)
+            melt_stage.items = activity_count
+        if sqlite:
+            with new_sqlite_store(sqlite_filename) as connection:
+                for melt_spool, table_name in zip(melt_spools, SQLITE_TABLES):
+                    with trace_stage("write-sqlite") as write_stage:
+                        melt_spool.to_sqlite(connection, table_name)
+                        melt_spool.close()
+                        write_stage.items = len(melt_spool.activity_ids)
+        for melt_spool, csv_filename in zip(melt_spools, [a_filename, a_add_filename, t_filename, b_filename] if not sqlite else []):
+            with trace_stage("write-csv") as write_stage:
+                melt_spool.to_csv(csv_filename)
+                melt_spool.close()
+                write_stage.items = len(melt_spool.activity_ids)
+        write_fingerprint_manifest(manifest_filename, fingerprints, error_records=activity_error_records)
+        return conversion_summary(len(melt_spools[0].activity_ids), len(melt_spools[2].activity_ids), len(melt_spools[3].activity_ids), validation)
 
     with open(xml_filename, "r") as xmlfile:
-        parser = etree.XMLParser(remove_blank_text=True)
-        tree = etree.parse(xmlfile, parser=parser)
-
-        # Sort IATI order, also activity-date@type
-        for parent in tree.xpath('//*[./*]'):  # Search for parent elements, reorder
-            parent[:] = sorted(parent, key=lambda x: iati_order(x))
-
-        # Add missing mandatory elements
-        for required_child in REQUIRED_CHILDREN:
-            parent_xpath, child_tag = required_child
-            matching_parents = tree.xpath(parent_xpath)
-            for matching_parent in matching_parents:
-                child_query = matching_parent.xpath(child_tag)
-                if not child_query:
-                    etree.SubElement(matching_parent, child_tag)
-
-        # Add missing mandatory attributes
-        for required_attrib in REQUIRED_ATTRIBUTES:
-            parent_xpath, attrib_key = required_attrib
-            matching_parents = tree.xpath(parent_xpath)
-            for matching_parent in matching_parents:
-                if attrib_key not in matching_parent.attrib:
-                    matching_parent.attrib[attrib_key] = ""
-
-        # Add default element values
-        for default_elem_val in DEFAULT_ELEM_VALS:
-            elem_xpath, default_value = default_elem_val
-            matching_elems = tree.xpath(elem_xpath)
-            for matching_elem in matching_elems:
-                if not matching_elem.text:
-                    matching_elem.text = default_value
-
-        # Add default element attributes
-        for default_attrib in DEFAULT_ATTRIBS:
-            elem_xpath, attrib_key, default_value = default_attrib
-            matching_elems = tree.xpath(elem_xpath)
-            for matching_elem in matching_elems:
-                if attrib_key not in matching_elem.attrib:
-                    matching_elem.attrib[attrib_key] = default_value
-                elif matching_elem.attrib[attrib_key] == "":
-                    matching_elem.attrib[attrib_key] = default_value
-
-        root = tree.getroot()
-
-        activities_static, activities_additions, transactions, budgets = melt_iati(root)
-        a_df = pd.DataFrame(activities_static, dtype=str)
-        a_df = a_df.reindex(sorted(a_df.columns, key=iati_order_xpath), axis=1).sort_values('iati-activity/iati-identifier[1]')
-        a_df.to_csv(a_filename, index=False)
-        a_add_df = pd.DataFrame(activities_additions, dtype=str)
-        a_add_df = a_add_df.reindex(sorted(a_add_df.columns, key=iati_order_xpath), axis=1).sort_values('iati-activity/iati-identifier[1]')
-        a_add_df.to_csv(a_add_filename, index=False)
-        t_df = pd.DataFrame(transactions, dtype=str)
-        t_df = t_df.reindex(sorted(t_df.columns, key=iati_order_xpath), axis=1).sort_values('iati-activity/iati-identifier[1]')
-        t_df.to_csv(t_filename, index=False)
-        b_df = pd.DataFrame(budgets, dtype=str)
-        b_df = b_df.reindex(sorted(b_df.columns, key=iati_order_xpath), axis=1).sort_values('iati-activity/iati-identifier[1]')
-        b_df.to_csv(b_filename, index=False)
+        with trace_stage("parse") as parse_stage:
+            parser = etree.XMLParser(remove_blank_text=True)
+            tree = etree.parse(xmlfile, parser=parser)
+            root = tree.getroot()
+            parse_stage.items = len(root)
+        with trace_stage("fingerprint") as fingerprint_stage:
+            fingerprints = fingerprint_activities(index_activities(root))
+            fingerprint_stage.items = len(fingerprints)
+        with trace_stage("normalise"):
+            normalise_element(root)
+
+        with trace_stage("melt") as melt_stage:
+            activities_static, activities_additions, transactions, budgets = melt_iati(root)
+            melt_stage.items = len(activities_static)
+        if sqlite:
+            melted_to_sqlite((activities_static, activities_additions, transactions, budgets), sqlite_filename)
+        else:
+            melted_to_csv(activities_static, a_filename)
+            melted_to_csv(activities_additions, a_add_filename)
+            melted_to_csv(transactions, t_filename)
+            melted_to_csv(budgets, b_filename)
+    write_fingerprint_manifest(manifest_filename, fingerprints, error_records=activity_error_records)
+    return conversion_summary(len(activities_static), len(transactions), len(budgets), validation)
 
 
 def open_csv_dir(csv_dir):
@@ -705,86 +1527,914 @@ def open_csv_dir(csv_dir):
     t_filename = os.path.join(csv_dir, "transactions.csv")
     b_filename = os.path.join(csv_dir, "budgets.csv")
 
-    a_static_df = pd.read_csv(a_filename, dtype=str).fillna("")
-    a_add_df = pd.read_csv(a_add_filename, dtype=str).fillna("")
-    a_df = pd.merge(a_static_df, a_add_df, on='iati-activity/iati-identifier[1]')
-    a_df = a_df.reindex(sorted(a_df.columns, key=xpath_sort), axis=1).sort_values('iati-activity/iati-identifier[1]')
-
-    t_df = pd.read_csv(t_filename, dtype=str).fillna("")
-    t_df = t_df.reindex(sorted(t_df.columns, key=xpath_sort), axis=1).sort_values('iati-activity/iati-identifier[1]')
-    b_df = pd.read_csv(b_filename, dtype=str).fillna("")
-    b_df = b_df.reindex(sorted(b_df.columns, key=xpath_sort), axis=1).sort_values('iati-activity/iati-identifier[1]')
-    activities = a_df.to_dict(into=OrderedDict, orient='records')
-    transactions = t_df.to_dict(into=OrderedDict, orient='records')
-    budgets = b_df.to_dict(into=OrderedDict, orient='records')
+    report_progress("Reading CSVs", 0)
+    with trace_stage("read-csv") as read_stage:
+        a_static_df = pd.read_csv(a_filename, dtype=str).fillna("")
+        a_add_df = pd.read_csv(a_add_filename, dtype=str).fillna("")
+        t_df = pd.read_csv(t_filename, dtype=str).fillna("")
+        b_df = pd.read_csv(b_filename, dtype=str).fillna("")
+        read_stage.items = len(a_static_df) + len(a_add_df) + len(t_df) + len(b_df)
+
+    with trace_stage("sort"):
+        a_df = pd.merge(a_static_df, a_add_df, on='iati-activity/iati-identifier[1]')
+        a_df = a_df.reindex(sorted(a_df.columns, key=xpath_sort), axis=1).sort_values('iati-activity/iati-identifier[1]', kind="mergesort")
+        t_df = t_df.reindex(sorted(t_df.columns, key=xpath_sort), axis=1).sort_values('iati-activity/iati-identifier[1]', kind="mergesort")
+        b_df = b_df.reindex(sorted(b_df.columns, key=xpath_sort), axis=1).sort_values('iati-activity/iati-identifier[1]', kind="mergesort")
+    with trace_stage("to-records") as records_stage:
+        activities = a_df.to_dict(into=OrderedDict, orient='records')
+        transactions = t_df.to_dict(into=OrderedDict, orient='records')
+        budgets = b_df.to_dict(into=OrderedDict, orient='records')
+        records_stage.items = len(activities) + len(transactions) + len(budgets)
     return (activities, transactions, budgets)
 
 
-def csv_to_xml(csv_dir, xml_filename=None):
+def spool_csv(csv_filename, chunk_size=STREAM_CHUNK_SIZE):
+    # Reads a CSV a chunk at a time onto a spool, as open_csv_dir reads it whole; returns the spool and its columns
+    csv_spool = MeltSpool()
+    for chunk_df in pd.read_csv(csv_filename, dtype=str, chunksize=chunk_size):
+        for record in chunk_df.fillna("").to_dict(orient='records'):
+            csv_spool.append(record)
+    return csv_spool, sorted(pd.read_csv(csv_filename, dtype=str, nrows=0).columns, key=xpath_sort)
+
+
+def iter_spooled_records(csv_spool, columns):
+    # Only the identifiers are sorted in memory, with the sort open_csv_dir uses, so rows of one activity come out in its order
+    row_order = pd.Series(csv_spool.activity_ids, dtype=str).sort_values(kind="mergesort").index
+    for record in csv_spool.ordered_records(row_order):
+        yield OrderedDict((column, record[column]) for column in columns)
+
+
+def iter_joined_activities(static_records, additions_records, activity_columns):
+    # Inner join on identifier of two tables sorted on it, as open_csv_dir's pd.merge
+    additions_iter = iter(additions_records)
+    additions_record = next(additions_iter, None)
+    matching_id = None
+    matching_records = []
+    for static_record in static_records:
+        static_id = static_record["iati-activity/iati-identifier[1]"]
+        if static_id != matching_id:
+            matching_id = static_id
+            matching_records = []
+            while additions_record is not None and additions_record["iati-activity/iati-identifier[1]"] <= static_id:
+                if additions_record["iati-activity/iati-identifier[1]"] == static_id:
+                    matching_records.append(additions_record)
+                additions_record = next(additions_iter, None)
+        for matching_record in matching_records:
+            activity = dict(matching_record)
+            activity.update(static_record)
+            yield OrderedDict((column, activity[column]) for column in activity_columns)
+
+
+def open_csv_dir_bundles(csv_dir):
+    # open_csv_dir as a stream of (activity, its transactions, its budgets), for casting one activity at a time. The CSVs are
+    # read in chunks onto disk spools, then merge-joined on identifier; returns the bundles, each table's columns and row counts
+    csv_filenames = [os.path.join(csv_dir, csv_basename) for csv_basename in ["activities_static.csv", "activities_additions.csv", "transactions.csv", "budgets.csv"]]
+    report_progress("Reading CSVs", 0)
+    with trace_stage("read-csv") as read_stage:
+        (static_spool, static_columns), (additions_spool, additions_columns), (t_spool, t_columns), (b_spool, b_columns) = [
+            spool_csv(csv_filename) for csv_filename in csv_filenames]
+        read_stage.items = sum(len(csv_spool.activity_ids) for csv_spool in [static_spool, additions_spool, t_spool, b_spool])
+    activity_columns = sorted(set(static_columns).union(additions_columns), key=xpath_sort)
+
+    def iter_bundles():
+        try:
+            activities = iter_joined_activities(iter_spooled_records(static_spool, static_columns),
+                                                iter_spooled_records(additions_spool, additions_columns), activity_columns)
+            for bundle in iter_activity_bundles(activities, iter_spooled_records(t_spool, t_columns), iter_spooled_records(b_spool, b_columns)):
+                yield bundle
+        finally:
+            for csv_spool in [static_spool, additions_spool, t_spool, b_spool]:
+                csv_spool.close()
+    row_counts = [len(static_spool.activity_ids), len(t_spool.activity_ids), len(b_spool.activity_ids)]
+    return iter_bundles(), (activity_columns, t_columns, b_columns), row_counts
+
+
+def load_codelist_checks(version):
+    # Codelist mapping paths of activities, "iati-activity/sector@code", to (codelist name, its codes as a set, whether the
+    # codelist is complete, the vocabularies it applies to or None for any, whether it applies with no vocabulary)
+    codelists = {}
+    for codelist_filename in get_codelist_paths(version):
+        codelist_root = etree.parse(codelist_filename).getroot()
+        codes = set(code_elem.text for code_elem in codelist_root.iterfind("codelist-items/codelist-item/code") if code_elem.text)
+        codelists[codelist_root.get("name")] = (codes, codelist_root.get("complete") == "1")
+
+    mapping_filename = os.path.join(IATI_FOLDER, "resources", "standard", iati.resources.folder_name_for_version(version), "codelist-mapping.xml")
+    checks = {}
+    for mapping in etree.parse(mapping_filename).getroot().iterfind("mapping"):
+        mapping_path = mapping.findtext("path")
+        codelist_name = mapping.find("codelist").get("ref")
+        if not mapping_path.startswith("//iati-activity/") or codelist_name not in codelists:
+            continue
+        element_path, _, node = mapping_path[2:].rpartition(XPATH_SEPERATOR)
+        column_path = element_path if node == "text()" else element_path + ATTRIB_SEPERATOR + node[1:]
+        vocabularies, without_vocabulary = None, False
+        condition = mapping.findtext("condition")
+        if condition:  # Only the "@vocabulary = '1' or not(@vocabulary)" kind occur for activities
+            vocabularies = set(re.findall(r"@vocabulary = '([^']*)'", condition))
+            without_vocabulary = "not(@vocabulary)" in condition
+            if not vocabularies:
+                continue
+        checks[column_path] = (codelist_name,) + codelists[codelist_name] + (vocabularies, without_vocabulary)
+    return checks
+
+
+def column_check_path(column_key):
+    # "transaction/sector[2]@code" -> "iati-activity/transaction/sector@code", as the codelist mapping has it
+    if not column_key.startswith("iati-activity"):
+        column_key = "iati-activity" + XPATH_SEPERATOR + column_key
+    return re.sub(r"\[\d+\]", "", column_key)
+
+
+def check_csv_columns(csv_filename, checks):
+    # Bad cells of one CSV, each column checked at once: codes against their codelist, dates and numbers by their format
+    header = pd.read_csv(csv_filename, dtype=str, nrows=0).columns
+    column_checks = [(column_key, checks.get(column_check_path(column_key))) for column_key in header]
+    column_checks = [(column_key, check) for column_key, check in column_checks
+                     if check is not None or DATE_COLUMN_PATTERN.search(column_key) or NUMBER_COLUMN_PATTERN.search(column_key)]
+    if not column_checks:
+        return []
+    read_columns = set(column_key for column_key, _ in column_checks)
+    read_columns.update(column_key.rpartition(ATTRIB_SEPERATOR)[0] + "@vocabulary" for column_key, check in column_checks if check is not None and check[3] is not None)
+    csv_df = pd.read_csv(csv_filename, dtype=str, usecols=[column_key for column_key in header if column_key in read_columns])
+
+    bad_cell_frames = []
+    for column_key, check in column_checks:
+        values = csv_df[column_key]
+        present = values.notnull()  # Blank cells are left to the schema
+        if check is not None:
+            codelist_name, codes, complete, vocabularies, without_vocabulary = check
+            bad = present & ~values.isin(codes)
+            if vocabularies is not None:
+                vocabulary_key = column_key.rpartition(ATTRIB_SEPERATOR)[0] + "@vocabulary"
+                vocabulary_values = csv_df[vocabulary_key] if vocabulary_key in csv_df.columns else pd.Series(None, index=csv_df.index, dtype=str)
+                bad &= vocabulary_values.isin(vocabularies) | (vocabulary_values.isnull() & without_vocabulary)
+            problem, status = "Not in the {} codelist".format(codelist_name), "error" if complete else "warning"
+        elif DATE_COLUMN_PATTERN.search(column_key):  # Dates repeat, so each distinct one is checked once
+            dates = pd.Series(values.dropna().unique(), dtype=str)
+            well_formed = dates.str.match(ISO_DATE_PATTERN)
+            bad_dates = dates[~(well_formed & pd.to_datetime(dates.where(well_formed), format="%Y-%m-%d", errors="coerce").notnull())]
+            bad = values.isin(bad_dates)
+            problem, status = "Not a date as YYYY-MM-DD", "error"
+        else:
+            bad = present & pd.to_numeric(values, errors="coerce").isnull()
+            problem, status = "Not a number", "error"
+        if bad.any():
+            bad_values = values[bad]
+            bad_cell_frames.append(pd.DataFrame(OrderedDict([
+                ("file", os.path.basename(csv_filename)),
+                ("row", bad_values.index + 2),  # As numbered in a spreadsheet, the header being row 1
+                ("column", column_key),
+                ("value", bad_values.values),
+                ("problem", problem),
+                ("status", status),
+            ])))
+    return bad_cell_frames
+
+
+def prevalidate_csv_dir(csv_dir, errors_filename):
+    # Checks the CSVs before building the XML, so bad cells are reported by file, row and column rather than XML line
+    report_progress("Checking CSVs", 0)
+    checks = get_codelist_checks()
+    bad_cell_frames = []
+    for csv_basename in CSV_BASENAMES:
+        bad_cell_frames.extend(check_csv_columns(os.path.join(csv_dir, csv_basename), checks))
+    if not bad_cell_frames:
+        print("CSVs have valid codes, dates and numbers: True")
+        return 0
+    bad_cells = pd.concat(bad_cell_frames, ignore_index=True).sort_values(["file", "row"], kind="mergesort")
+    error_count = int((bad_cells["status"] == "error").sum())
+    print("CSVs have valid codes, dates and numbers: {}".format(not error_count))
+    print("Writing {} CSV cell problems to '{}'... Done.".format(len(bad_cells), errors_filename))
+    bad_cells.to_csv(errors_filename, index=False, columns=CSV_ERROR_COLUMNS)
+    return error_count
+
+
+def sqlite_quote(identifier):
+    return '"{}"'.format(identifier.replace('"', '""'))
+
+
+def csv_row_order(row_ids):
+    # Positions of melted rows in the order open_csv_dir gives them: melted_to_csv sorts the rows, and open_csv_dir sorts
+    # them again once read, both stably, but a missing identifier sorts last when written and first, as "", when read
+    written_ids = pd.Series(row_ids, dtype=str).sort_values(kind="mergesort")
+    read_ids = pd.Series(written_ids.values, dtype=str).fillna("")
+    return written_ids.index[read_ids.sort_values(kind="mergesort").index]
+
+
+@contextlib.contextmanager
+def new_sqlite_store(sqlite_filename):
+    # A connection to a new store, written beside sqlite_filename and only replacing it once every table is written
+    temporary_filename = "{}.{}.tmp".format(sqlite_filename, os.getpid())
+    if os.path.exists(temporary_filename):
+        os.remove(temporary_filename)
+    connection = sqlite3.connect(temporary_filename)
+    try:
+        connection.execute("PRAGMA journal_mode = OFF")  # The store is always written whole, so there is nothing to roll back to
+        connection.execute("PRAGMA synchronous = OFF")
+        yield connection
+        connection.commit()
+        connection.close()
+        os.replace(temporary_filename, sqlite_filename)
+    finally:
+        connection.close()
+        if os.path.exists(temporary_filename):
+            os.remove(temporary_filename)
+
+
+def write_sqlite_table(connection, table_name, columns, records):
+    # Rows are stored in the order open_csv_dir would give them, so reading them by row_order needs no sort
+    if "iati-activity/iati-identifier[1]" not in columns:
+        columns = ["iati-activity/iati-identifier[1]"] + list(columns)
+    if len(columns) > SQLITE_MAX_WIDE_COLUMNS:
+        write_long_sqlite_table(connection, table_name, columns, records)
+        return
+    connection.execute("CREATE TABLE {} (row_order INTEGER PRIMARY KEY, {})".format(
+        sqlite_quote(table_name), ", ".join("{} TEXT".format(sqlite_quote(column)) for column in columns)))
+    insert_sql = "INSERT INTO {} VALUES ({})".format(sqlite_quote(table_name), ", ".join(["?"] * (len(columns) + 1)))
+    connection.executemany(insert_sql, ((row_index,) + tuple(record.get(column) for column in columns) for row_index, record in enumerate(records)))
+    connection.execute("CREATE INDEX {} ON {} ({})".format(
+        sqlite_quote(table_name + "_identifier"), sqlite_quote(table_name), sqlite_quote("iati-activity/iati-identifier[1]")))
+
+
+def write_long_sqlite_table(connection, table_name, columns, records):
+    # A table too wide for SQLite, as (row_order, identifier, column, value) for each value a row has, its columns listed in
+    # order in a <table>_columns table. Every row keeps its identifier cell, so rows with no other values are kept too
+    id_column = "iati-activity/iati-identifier[1]"
+    connection.execute("CREATE TABLE {} (row_order INTEGER, {} TEXT, column_key TEXT, value TEXT, PRIMARY KEY (row_order, column_key))".format(
+        sqlite_quote(table_name), sqlite_quote(id_column)))
+    connection.execute("CREATE TABLE {} (position INTEGER PRIMARY KEY, column_key TEXT)".format(sqlite_quote(table_name + "_columns")))
+    connection.executemany("INSERT INTO {} VALUES (?, ?)".format(sqlite_quote(table_name + "_columns")), enumerate(columns))
+    insert_sql = "INSERT INTO {} VALUES (?, ?, ?, ?)".format(sqlite_quote(table_name))
+    connection.executemany(insert_sql, ((row_index, record.get(id_column), column, record.get(column))
+                                        for row_index, record in enumerate(records)
+                                        for column in columns if column == id_column or record.get(column) is not None))
+    connection.execute("CREATE INDEX {} ON {} ({})".format(
+        sqlite_quote(table_name + "_identifier"), sqlite_quote(table_name), sqlite_quote(id_column)))
+
+
+def melted_to_sqlite(melt_tables, sqlite_filename):
+    # The four melt_iati tables as one indexed database, rather than four CSVs
+    with new_sqlite_store(sqlite_filename) as connection:
+        for table_name, melt_table in zip(SQLITE_TABLES, melt_tables):
+            with trace_stage("write-sqlite") as write_stage:
+                records = list(melt_table.records())
+                row_order = csv_row_order([record.get("iati-activity/iati-identifier[1]") for record in records])
+                write_sqlite_table(connection, table_name, sorted(melt_table.columns, key=iati_order_xpath), (records[row_index] for row_index in row_order))
+                write_stage.items = len(records)
+
+
+def is_long_sqlite_table(connection, table_name):
+    return connection.execute("SELECT COUNT(*) FROM sqlite_master WHERE type = 'table' AND name = ?", (table_name + "_columns",)).fetchone()[0] > 0
+
+
+def sqlite_table_columns(connection, table_name):
+    if is_long_sqlite_table(connection, table_name):
+        return [column for column, in connection.execute("SELECT column_key FROM {} ORDER BY position".format(sqlite_quote(table_name + "_columns")))]
+    cursor = connection.execute("SELECT * FROM {} LIMIT 0".format(sqlite_quote(table_name)))
+    return [column_description[0] for column_description in cursor.description[1:]]
+
+
+def sqlite_table_row_count(connection, table_name):
+    if is_long_sqlite_table(connection, table_name):
+        return connection.execute("SELECT COUNT(DISTINCT row_order) FROM {}".format(sqlite_quote(table_name))).fetchone()[0]
+    return connection.execute("SELECT COUNT(*) FROM {}".format(sqlite_quote(table_name))).fetchone()[0]
+
+
+def iter_sqlite_records(connection, table_name, columns):
+    # Rows as open_csv_dir gives them: every column, in xpath_sort order, empty strings for missing values
+    if is_long_sqlite_table(connection, table_name):
+        cursor = connection.execute("SELECT row_order, column_key, value FROM {} ORDER BY row_order".format(sqlite_quote(table_name)))
+        for _, row_cells in itertools.groupby(cursor, key=lambda cell: cell[0]):
+            row_values = dict((column, value) for _, column, value in row_cells if value is not None)
+            yield OrderedDict((column, row_values.get(column, "")) for column in columns)
+        return
+    cursor = connection.execute("SELECT {} FROM {} ORDER BY row_order".format(
+        ", ".join(["row_order"] + [sqlite_quote(column) for column in columns]), sqlite_quote(table_name)))
+    for row in cursor:
+        yield OrderedDict(zip(columns, ["" if value is None else value for value in row[1:]]))
+
+
+def sqlite_store_columns(connection):
+    # Columns of the activities (joined to their additions), transactions and budgets, in xpath_sort order
+    activity_columns = sqlite_table_columns(connection, "activities")
+    activity_columns += [column for column in sqlite_table_columns(connection, "additions") if column not in activity_columns]
+    return [sorted(columns, key=xpath_sort) for columns in
+            [activity_columns, sqlite_table_columns(connection, "transactions"), sqlite_table_columns(connection, "budgets")]]
+
+
+def iter_sqlite_activities(connection, activity_columns):
+    # Both tables hold one row per activity, in the same order, so the join is a zip
+    static_columns = sqlite_table_columns(connection, "activities")
+    additions_columns = [column for column in sqlite_table_columns(connection, "additions") if column not in static_columns]
+    for static_record, additions_record in zip(iter_sqlite_records(connection, "activities", static_columns),
+                                               iter_sqlite_records(connection, "additions", additions_columns)):
+        static_record.update(additions_record)
+        yield OrderedDict((column, static_record[column]) for column in activity_columns)
+
+
+def open_sqlite_store(sqlite_filename):
+    # The same lists open_csv_dir reads from a CSV directory
+    connection = sqlite3.connect(sqlite_filename)
+    activity_columns, transaction_columns, budget_columns = sqlite_store_columns(connection)
+    with trace_stage("read-sqlite") as read_stage:
+        activities = list(iter_sqlite_activities(connection, activity_columns))
+        transactions = list(iter_sqlite_records(connection, "transactions", transaction_columns))
+        budgets = list(iter_sqlite_records(connection, "budgets", budget_columns))
+        read_stage.items = len(activities) + len(transactions) + len(budgets)
+    connection.close()
+    return activities, transactions, budgets
+
+
+def sqlite_store_row_counts(sqlite_filename):
+    connection = sqlite3.connect(sqlite_filename)
+    row_counts = [sqlite_table_row_count(connection, table_name) for table_name in ["activities", "transactions", "budgets"]]
+    connection.close()
+    return row_counts
+
+
+def iter_sqlite_store_activities(sqlite_filename, activity_count=0):
+    # Activities built one at a time as their rows stream from the store, with no table held in memory
+    connection = sqlite3.connect(sqlite_filename)
+    try:
+        activity_columns, transaction_columns, budget_columns = sqlite_store_columns(connection)
+        bundles = iter_activity_bundles(iter_sqlite_activities(connection, activity_columns),
+                                        iter_sqlite_records(connection, "transactions", transaction_columns),
+                                        iter_sqlite_records(connection, "budgets", budget_columns))
+        for activity_elem in iter_bundle_activities(bundles, activity_columns, transaction_columns, budget_columns, activity_count):
+            yield activity_elem
+    finally:
+        connection.close()
+
+
+def records_by_activity(records_list):
+    activity_records = {}
+    for record in records_list:
+        activity_records.setdefault(record["iati-activity/iati-identifier[1]"], []).append(record)
+    return activity_records
+
+
+def activity_rows_hash(activity, activity_transactions, activity_budgets):
+    # Only non-empty values are cast, so column order and empty columns don't change the hash
+    activity_rows = [[sorted((column_key, value) for column_key, value in record.items() if value != "") for record in records_list]
+                     for records_list in [[activity], activity_transactions, activity_budgets]]
+    return hashlib.sha256(json.dumps(activity_rows).encode("utf-8")).hexdigest()
+
+
+def row_manifest_filename_for(xml_filename):
+    return os.path.splitext(xml_filename)[0] + ROW_MANIFEST_SUFFIX
+
+
+def write_row_manifest(manifest_filename, xml_bytes, row_hashes, error_records):
+    manifest = OrderedDict([
+        ("version", ROW_MANIFEST_VERSION),
+        ("xml-sha256", hashlib.sha256(xml_bytes).hexdigest()),
+        ("row-hashes", list(row_hashes.items())),
+        ("error-records", error_records),
+    ])
+    with open(manifest_filename, "w", encoding="utf-8") as manifest_file:
+        json.dump(manifest, manifest_file, indent=1)
+
+
+def read_row_manifest(manifest_filename, xml_bytes):
+    # None unless the manifest describes exactly the XML it sits beside
+    try:
+        with open(manifest_filename, "r", encoding="utf-8") as manifest_file:
+            manifest = json.load(manifest_file, object_pairs_hook=OrderedDict)
+    except (OSError, ValueError):
+        return None
+    if manifest.get("version") != ROW_MANIFEST_VERSION or manifest.get("xml-sha256") != hashlib.sha256(xml_bytes).hexdigest():
+        return None
+    return manifest
+
+
+def incremental_cast_iati(activities, transactions, budgets, xml_filename, workers=1, validation_workers=None):
+    # Rebuilds and revalidates only the activities whose rows changed since the manifest beside xml_filename was written
+    activity_ids = [activity["iati-activity/iati-identifier[1]"] for activity in activities]
+    transactions_by_id = records_by_activity(transactions)
+    budgets_by_id = records_by_activity(budgets)
+    row_hashes = OrderedDict(
+        (activity_id, activity_rows_hash(activity, transactions_by_id.get(activity_id, []), budgets_by_id.get(activity_id, [])))
+        for activity_id, activity in zip(activity_ids, activities))
+
+    previous_hashes = {}
+    previous_elems = {}
+    previous_records = {}
+    manifest_filename = row_manifest_filename_for(xml_filename)
+    if activities and len(row_hashes) == len(activity_ids) and os.path.exists(xml_filename):  # Duplicate identifiers rebuild everything
+        with open(xml_filename, "rb") as xmlfile:
+            previous_xml_bytes = xmlfile.read()
+        manifest = read_row_manifest(manifest_filename, previous_xml_bytes)
+        if manifest is not None:
+            previous_root = etree.fromstring(previous_xml_bytes, etree.XMLParser(remove_blank_text=True))
+            if len(previous_root) == len(manifest["row-hashes"]):
+                previous_hashes = OrderedDict(manifest["row-hashes"])
+                previous_elems = dict(zip(previous_hashes.keys(), previous_root))
+                for err_rec in manifest["error-records"]:
+                    previous_records.setdefault(err_rec["iati-activity/iati-identifier[1]"], []).append(OrderedDict(err_rec))
+
+    rebuilt_ids = set(activity_id for activity_id in activity_ids if previous_hashes.get(activity_id) != row_hashes[activity_id])
+    removed_count = len([activity_id for activity_id in previous_hashes if activity_id not in row_hashes])
+    print("Rebuilding {} of {} activities, {} removed".format(len(rebuilt_ids), len(activity_ids), removed_count))
+
+    rebuilt_activities = [activity for activity_id, activity in zip(activity_ids, activities) if activity_id in rebuilt_ids]
+    rebuilt_transactions = [transaction for transaction in transactions if transaction["iati-activity/iati-identifier[1]"] in rebuilt_ids]
+    rebuilt_budgets = [budget for budget in budgets if budget["iati-activity/iati-identifier[1]"] in rebuilt_ids]
+    doc = cast_iati(rebuilt_activities, rebuilt_transactions, rebuilt_budgets, workers=workers)
+    root = doc.getroot()
+    if not previous_elems:
+        error_records = chunked_validation(io.BytesIO(etree.tostring(doc, encoding="utf-8")), validation_workers or 1)
+        return doc, row_hashes, error_records
+
+    rebuilt_records = {}
+    if rebuilt_activities:
+        for err_rec in chunked_validation(io.BytesIO(etree.tostring(doc, encoding="utf-8")), validation_workers or 1):
+            rebuilt_records.setdefault(err_rec["iati-activity/iati-identifier[1]"], []).append(err_rec)
+
+    # Splice the rebuilt activities in among the unchanged ones, in the order a full conversion would give
+    rebuilt_elems = iter(list(root)) if rebuilt_activities else iter([])
+    root[:] = [next(rebuilt_elems) if activity_id in rebuilt_ids else previous_elems[activity_id] for activity_id in activity_ids]
+
+    error_records = []
+    for activity_id in activity_ids:
+        error_records.extend(rebuilt_records.get(activity_id, []) if activity_id in rebuilt_ids else previous_records.get(activity_id, []))
+    for err_rec in previous_records.get("", []) + rebuilt_records.get("", []):  # Document level errors, once each
+        if err_rec not in error_records:
+            error_records.append(err_rec)
+    return doc, row_hashes, error_records
+
+
+@traced_pipeline
+def csv_to_xml(csv_dir, xml_filename=None, workers=1, validation_workers=None, incremental=False, sqlite=False):
     if not xml_filename:
         xml_filename = os.path.normpath(csv_dir) + "_converted.xml"
-    print("Converting CSV files from '{}' to IATI XML at '{}'".format(csv_dir, xml_filename))
-
-    activities, transactions, budgets = open_csv_dir(csv_dir)
-    doc = cast_iati(activities, transactions, budgets)
-
-    with open(xml_filename, "wb") as xmlfile:
-        doc.write(xmlfile, encoding="utf-8", pretty_print=True)
-
-    # Validate
-    dataset = iati.utilities.load_as_dataset(xml_filename)
-    print("Output is valid XML: {}".format(iati.validator.is_xml(dataset)))
-    print("Output is valid IATI: {}".format(iati.validator.is_iati_xml(dataset, v203_schema)))
-    fully_valid = iati.validator.is_valid(dataset, v203_schema)
-    print("Output has valid IATI schema and rules: {}".format(fully_valid))
-    if not fully_valid:
-        print("Writing output validation error CSV... Done.")
-        error_log = iati.validator.full_validation(dataset, v203_schema)
-        error_records = [{"info": err_rec.info, "description": err_rec.description, "status": err_rec.status} for err_rec in error_log]
-        pd.DataFrame(error_records).to_csv(os.path.join(csv_dir, "output_validation_errors.csv"))
-
-
-def elements_equal(e1, e2):
-    if e1.tag != e2.tag:
-        return False
-    if e1.text != e2.text:
-        return False
-    if e1.tail != e2.tail:
-        return False
-    if e1.attrib != e2.attrib:
-        return False
-    if len(e1) != len(e2):
-        return False
-    if not all(elements_equal(c1, c2) for c1, c2 in zip(e1, e2)):
-        return False
-    return True
-
-
-def xml_differencer(past_xml_filename, current_xml_filename, updated_xml_filename):
+    print("Converting {} from '{}' to IATI XML at '{}'".format("SQLite store" if sqlite else "CSV files", csv_dir, xml_filename))
+    errors_filename = os.path.join(csv_dir, "output_validation_errors.csv")
+    sqlite_filename = os.path.join(csv_dir, SQLITE_STORE_BASENAME)
+    extra_counts = []
+    if not sqlite:
+        with trace_stage("prevalidate") as prevalidate_stage:
+            csv_error_count = prevalidate_stage.items = prevalidate_csv_dir(csv_dir, os.path.join(csv_dir, CSV_ERRORS_BASENAME))
+        extra_counts.append(("csv-errors", csv_error_count))
+
+    if incremental:
+        activities, transactions, budgets = open_sqlite_store(sqlite_filename) if sqlite else open_csv_dir(csv_dir)
+        with trace_stage("cast") as cast_stage:  # Includes validating the rebuilt activities
+            doc, row_hashes, error_records = incremental_cast_iati(activities, transactions, budgets, xml_filename, workers, validation_workers)
+            cast_stage.items = len(activities)
+        with trace_stage("write-xml") as write_stage:
+            xml_bytes = etree.tostring(doc, encoding="utf-8", pretty_print=True)
+            with open(xml_filename, "wb") as xmlfile:
+                xmlfile.write(xml_bytes)
+            write_row_manifest(row_manifest_filename_for(xml_filename), xml_bytes, row_hashes, error_records)
+            write_stage.items = len(doc.getroot())
+        validation = report_validation(error_records, errors_filename, "Output", VALIDATION_ERROR_COLUMNS, True)  # The rebuilt activities were parsed to validate them
+        return conversion_summary(len(activities), len(transactions), len(budgets), validation, extra_counts)
+
+    # Each activity is written out as soon as it is built, rather than the whole document held and then written
+    if sqlite and workers == 1:  # Rows streamed from the store too
+        row_counts = sqlite_store_row_counts(sqlite_filename)
+        activity_elems = iter_sqlite_store_activities(sqlite_filename, row_counts[0])
+    elif workers == 1:  # And from the CSVs, read in chunks and merged
+        bundles, table_columns_list, row_counts = open_csv_dir_bundles(csv_dir)
+        activity_elems = iter_bundle_activities(bundles, *table_columns_list, activity_count=row_counts[0])
+    else:
+        activities, transactions, budgets = open_sqlite_store(sqlite_filename) if sqlite else open_csv_dir(csv_dir)
+        row_counts = [len(activities), len(transactions), len(budgets)]
+        if activities:
+            activity_elems = iter_cast_chunks(activities, transactions, budgets, workers)
+        else:
+            activity_elems = iter([])
+    with trace_stage("cast-write-xml") as cast_stage:  # Building and writing interleave
+        cast_stage.items = write_iati_stream(xml_filename, activity_elems)
+
+    # Validate, reading the written file back from disk as the built activities aren't kept
+    with trace_stage("validate") as validate_stage:
+        validation = validate_xml(xml_filename, errors_filename, "Output", validation_workers)
+        validate_stage.items = validation["errors"]
+    return conversion_summary(*row_counts, validation=validation, extra_counts=extra_counts)
+
+
+def index_activities(root):
+    activities = OrderedDict()
+    for activity in root.iter("iati-activity"):
+        iati_id = activity.find("iati-identifier")
+        if iati_id is not None and iati_id.text is not None and iati_id.text not in activities:
+            activities[iati_id.text] = activity
+    return activities
+
+
+def canonical_tokens(element, ignored_attributes):
+    # Tag, sorted attributes and whitespace-normalised text; tails and comments are ignored
+    yield FINGERPRINT_OPEN + element.tag
+    for attrib_key in sorted(element.attrib.keys()):
+        if attrib_key not in ignored_attributes:
+            yield FINGERPRINT_ATTRIB + attrib_key + FINGERPRINT_ATTRIB + element.attrib[attrib_key]
+    yield FINGERPRINT_TEXT + (" ".join(element.text.split()) if element.text else "")
+    for child_elem in element:
+        if isinstance(child_elem.tag, str):
+            for token in canonical_tokens(child_elem, ignored_attributes):
+                yield token
+    yield FINGERPRINT_CLOSE
+
+
+def activity_fingerprint(activity, ignored_attributes=()):
+    digest = hashlib.sha256()
+    for token in canonical_tokens(activity, ignored_attributes):
+        digest.update(token.encode("utf-8"))
+    return digest.hexdigest()
+
+
+def fingerprint_activities(activities, ignored_attributes=()):
+    fingerprints = OrderedDict()
+    for activity_id, activity in activities.items():
+        fingerprints[activity_id] = activity_fingerprint(activity, ignored_attributes)
+        report_progress("Fingerprinting activities", len(fingerprints), len(activities))
+    return fingerprints
+
+
+def manifest_filename_for(xml_filename):
+    return os.path.splitext(xml_filename)[0] + FINGERPRINT_MANIFEST_SUFFIX
+
+
+def write_fingerprint_manifest(manifest_filename, fingerprints, ignored_attributes=(), error_records=None):
+    manifest = OrderedDict([("ignored-attributes", list(ignored_attributes)), ("fingerprints", fingerprints)])
+    if error_records is not None:  # A source manifest's input validation errors, each attributed to its activity
+        manifest["error-records"] = error_records
+    with open(manifest_filename, "w", encoding="utf-8") as manifest_file:
+        json.dump(manifest, manifest_file, indent=1)
+
+
+def read_fingerprint_manifest(manifest_filename):
+    with open(manifest_filename, "r", encoding="utf-8") as manifest_file:
+        manifest = json.load(manifest_file, object_pairs_hook=OrderedDict)
+    return manifest["fingerprints"], manifest["ignored-attributes"]
+
+
+def read_source_manifest(manifest_filename):
+    # None for the errors if the source was converted before they were kept, or was validated whole
+    with open(manifest_filename, "r", encoding="utf-8") as manifest_file:
+        manifest = json.load(manifest_file, object_pairs_hook=OrderedDict)
+    return manifest["fingerprints"], manifest.get("error-records")
+
+
+def changeset_filename_for(xml_filename):
+    return os.path.splitext(xml_filename)[0] + CHANGESET_SUFFIX
+
+
+def melt_activity_cells(activities):
+    # Activities melted as melt_iati does, though into one activity table with no default columns, as only real values are compared
+    activity_table, transactions, budgets = MeltTable(), MeltTable(), MeltTable()
+    for activity_id, activity in activities.items():
+        activity_values = []
+        melt_element(activity, "iati-activity", activity_values)
+        for column_key, value in activity_values:
+            if column_key != "iati-activity/iati-identifier[1]":
+                activity_table.add_value(column_key, value)
+        activity_table.add_value("iati-activity/iati-identifier[1]", activity_id)
+        activity_table.end_row()
+        melt_child_records(activity, "transaction", activity_id, transactions)
+        melt_child_records(activity, "budget", activity_id, budgets)
+    return activity_table, transactions, budgets
+
+
+def melted_cells(melt_tables):
+    # Long frame of identifier, absolute xpath and value, transactions and budgets numbered within their activity
+    id_column = "iati-activity/iati-identifier[1]"
+    cell_frames = []
+    for melt_table, record_tag in zip(melt_tables, [None, "transaction", "budget"]):
+        if not len(melt_table):
+            continue
+        table_df = melt_table.to_frame()
+        if record_tag is None:
+            cells_df = table_df.melt(id_vars=[id_column], var_name="xpath", value_name="value")
+        else:
+            table_df["record-index"] = (table_df.groupby(id_column, sort=False).cumcount() + 1).astype(str)
+            cells_df = table_df.melt(id_vars=[id_column, "record-index"], var_name="xpath", value_name="value")
+            cells_df["xpath"] = "iati-activity/" + record_tag + "[" + cells_df["record-index"] + "]" + cells_df["xpath"].str[len(record_tag):]
+            cells_df = cells_df.drop(columns="record-index")
+        cell_frames.append(cells_df.dropna(subset=["value"]))
+    if not cell_frames:
+        return pd.DataFrame(columns=[id_column, "xpath", "value"], dtype=str)
+    return pd.concat(cell_frames, ignore_index=True)
+
+
+def activity_changeset(past_activities, current_activities, ignored_attributes=()):
+    # Cells added, removed or changed between two sets of activities, aligned on identifier and xpath
+    id_column = "iati-activity/iati-identifier[1]"
+    past_cells = melted_cells(melt_activity_cells(past_activities))
+    current_cells = melted_cells(melt_activity_cells(current_activities))
+    cells_df = pd.merge(past_cells, current_cells, how="outer", on=[id_column, "xpath"], suffixes=("-old", "-new"))
+    cells_df = cells_df.rename(columns={"value-old": "old-value", "value-new": "new-value"})
+    if ignored_attributes:
+        ignored_pattern = "|".join(ATTRIB_SEPERATOR + re.escape(attrib_key) + "$" for attrib_key in ignored_attributes)
+        cells_df = cells_df[~cells_df["xpath"].str.contains(ignored_pattern)]
+
+    old_missing, new_missing = cells_df["old-value"].isnull(), cells_df["new-value"].isnull()
+    cells_df = cells_df[old_missing | new_missing | (cells_df["old-value"] != cells_df["new-value"])].copy()
+    cells_df["change"] = "changed"
+    cells_df.loc[old_missing, "change"] = "added"
+    cells_df.loc[new_missing, "change"] = "removed"
+
+    xpath_order = {xpath: xpath_index for xpath_index, xpath in enumerate(sorted(cells_df["xpath"].unique(), key=xpath_sort))}
+    cells_df["xpath-order"] = cells_df["xpath"].map(xpath_order)
+    cells_df = cells_df.sort_values([id_column, "xpath-order"], kind="mergesort")
+    return cells_df.reindex(columns=CHANGESET_COLUMNS)
+
+
+class SortedRuns(object):
+    # Records sorted in memory up to a budget at a time, each batch spilled to a temporary file, and merged back in order
+    def __init__(self, max_records):
+        self.max_records = max_records
+        self.buffer = []
+        self.run_files = []
+        self.record_count = 0
+
+    def __len__(self):
+        return self.record_count
+
+    def add(self, record):
+        self.buffer.append(record)
+        self.record_count += 1
+        if len(self.buffer) >= self.max_records:
+            self.spill()
+
+    def spill(self):
+        run_file = tempfile.TemporaryFile()
+        for record in sorted(self.buffer):
+            pickle.dump(record, run_file, pickle.HIGHEST_PROTOCOL)
+        self.run_files.append(run_file)
+        self.buffer = []
+
+    def iter_run(self, run_file):
+        run_file.seek(0)
+        while True:
+            try:
+                yield pickle.load(run_file)
+            except EOFError:
+                return
+
+    def __iter__(self):
+        self.buffer.sort()
+        return heapq.merge(iter(self.buffer), *[self.iter_run(run_file) for run_file in self.run_files])
+
+    def close(self):
+        for run_file in self.run_files:
+            run_file.close()
+        self.run_files = []
+        self.buffer = []
+
+
+def iter_top_level(xml_filename):
+    # Yields the root, then each of its children as it is finished, the children before it having been let go
+    depth = 0
+    root = None
+    context = etree.iterparse(xml_filename, events=("start", "end", "comment", "pi"))
+    for event, elem in context:
+        if event == "start":
+            if root is None:
+                root = elem
+                yield root
+            depth += 1
+        elif event == "end":
+            depth -= 1
+            if depth == 1:
+                yield elem
+                while root[0] is not elem:  # Comments and processing instructions before it
+                    del root[0]
+                elem.clear()
+                del root[0]
+        elif depth == 1:
+            yield elem
+    del context
+
+
+def iter_activity_records(xml_filename, ignored_attributes):
+    # (identifier, position, fingerprint) of each activity of a file in turn, its identifier "" if it has none
+    position = 0
+    for elem in itertools.islice(iter_top_level(xml_filename), 1, None):
+        if elem.tag == "iati-activity":
+            iati_id = elem.find("iati-identifier")
+            activity_id = iati_id.text if iati_id is not None and iati_id.text is not None else ""
+            yield activity_id, position, activity_fingerprint(elem, ignored_attributes)
+            position += 1
+            report_progress("Fingerprinting activities", position)
+
+
+def sorted_activity_records(activity_records, max_records):
+    sorted_records = SortedRuns(max_records)
+    for activity_record in activity_records:
+        sorted_records.add(activity_record)
+    return sorted_records
+
+
+def write_streamed_manifest(manifest_filename, fingerprint_items, ignored_attributes=()):
+    # write_fingerprint_manifest a fingerprint at a time, readable by read_fingerprint_manifest
+    with open(manifest_filename, "w", encoding="utf-8") as manifest_file:
+        manifest_file.write('{\n "ignored-attributes": ' + json.dumps(list(ignored_attributes), indent=1).replace("\n", "\n ") + ',\n "fingerprints": {')
+        for item_index, (activity_id, fingerprint) in enumerate(fingerprint_items):
+            manifest_file.write(("\n  " if not item_index else ",\n  ") + json.dumps(activity_id) + ": " + json.dumps(fingerprint))
+        manifest_file.write("\n }\n}")
+
+
+def write_kept_activities(current_xml_filename, updated_xml_filename, kept_positions):
+    # Streams the current file again, writing only the activities at kept_positions, which must be in order, with everything
+    # else that isn't an activity. Each is pretty printed alone in a copy of the root, as in write_iati_stream, so the bytes
+    # are those the in-memory differencer writes for the whole tree.
+    kept_positions = iter(kept_positions)
+    next_kept = next(kept_positions, None)
+    top_level = iter_top_level(current_xml_filename)
+    root = next(top_level)
+    root_copy = etree.Element(root.tag, root.attrib, nsmap=root.nsmap)
+    etree.SubElement(root_copy, "placeholder")
+    root_start = etree.tostring(root_copy, encoding="utf-8").split(b"<placeholder")[0]
+    root_end = "</{}>\n".format(root.tag).encode("utf-8")
+    del root_copy[0]
+    position = 0
+    written_count = 0
+    with replaced_on_success(updated_xml_filename) as xmlfile:
+        for elem in top_level:
+            if elem.tag == "iati-activity":
+                keep = position == next_kept
+                if keep:
+                    next_kept = next(kept_positions, None)
+                position += 1
+            else:
+                keep = True
+            if not keep:
+                continue
+            if not written_count:
+                xmlfile.write(root_start)
+            root_copy.text = root.text if not written_count else None  # The root's text once, before its first child
+            elem_copy = copy.deepcopy(elem)
+            root_copy.append(elem_copy)
+            elem_bytes = etree.tostring(root_copy, encoding="utf-8", pretty_print=True)[len(root_start):-len(root_end)]
+            root_copy.remove(elem_copy)
+            if written_count and root.text is None and elem_bytes.startswith(b"\n"):  # Newline after the start tag, written once
+                elem_bytes = elem_bytes[1:]
+            xmlfile.write(elem_bytes)
+            written_count += 1
+        if not written_count:
+            root_copy.text = root.text
+            xmlfile.write(etree.tostring(root_copy, encoding="utf-8", pretty_print=True))
+        else:
+            xmlfile.write(root_end)
+    return written_count
+
+
+def external_xml_differencer(past_xml_filename, current_xml_filename, updated_xml_filename, ignore_datetimes=False, write_manifest=False,
+                             memory_budget_mb=DIFF_MEMORY_BUDGET_MB):
+    # xml_differencer for files larger than memory. Both files are streamed, each activity reduced to its identifier, position
+    # and fingerprint, and those records sorted on disk in runs within the budget. Merge-joining the two sorted streams
+    # classifies every activity, and a second pass over the current file writes the new and changed ones.
+    ignored_attributes = DATETIME_ATTRIBUTES if ignore_datetimes else []
+    # The budget is shared by every run buffered at once: both files' records, the positions to keep and the manifest's
+    live_run_count = 4 if write_manifest else 3
+    max_records = max(1000, int(memory_budget_mb * 1024 * 1024 / DIFF_RUN_RECORD_BYTES / live_run_count))
+    if os.path.splitext(past_xml_filename)[1].lower() == ".json":
+        with trace_stage("read-manifest") as manifest_stage:
+            past_fingerprints, ignored_attributes = read_fingerprint_manifest(past_xml_filename)
+            past_records = sorted_activity_records(((past_id, 0, fingerprint) for past_id, fingerprint in past_fingerprints.items()), max_records)
+            manifest_stage.items = len(past_fingerprints)
+            del past_fingerprints
+    else:
+        with trace_stage("fingerprint") as fingerprint_stage:
+            past_records = sorted_activity_records(iter_activity_records(past_xml_filename, ignored_attributes), max_records)
+            fingerprint_stage.items = len(past_records)
+    with trace_stage("fingerprint") as fingerprint_stage:
+        current_records = sorted_activity_records(iter_activity_records(current_xml_filename, ignored_attributes), max_records)
+        fingerprint_stage.items = len(current_records)
+
+    counts = OrderedDict([("new-activities", 0), ("updated-activities", 0), ("unchanged-activities", 0), ("removed-activities", 0)])
+    kept_positions = SortedRuns(max_records)
+    manifest_records = SortedRuns(max_records) if write_manifest else None
+    with trace_stage("compare") as compare_stage:
+        # Only the first activity with an identifier counts, as in index_activities; the rest, and any without one, are kept
+        past_groups = itertools.groupby(past_records, key=lambda record: record[0])
+        past_id, past_group = next(past_groups, (None, None))
+        for current_id, current_group in itertools.groupby(current_records, key=lambda record: record[0]):
+            _, first_position, current_fingerprint = next(current_group)
+            for _, position, _ in current_group:
+                kept_positions.add(position)
+            if current_id == "":
+                kept_positions.add(first_position)
+                continue
+            while past_id is not None and past_id < current_id:
+                if past_id != "":
+                    counts["removed-activities"] += 1
+                past_id, past_group = next(past_groups, (None, None))
+            if past_id == current_id:
+                if next(past_group)[2] == current_fingerprint:
+                    counts["unchanged-activities"] += 1
+                else:
+                    counts["updated-activities"] += 1
+                    kept_positions.add(first_position)
+                past_id, past_group = next(past_groups, (None, None))
+            else:
+                counts["new-activities"] += 1
+                kept_positions.add(first_position)
+            if manifest_records is not None:  # Sorted back into document order
+                manifest_records.add((first_position, current_id, current_fingerprint))
+        while past_id is not None:
+            if past_id != "":
+                counts["removed-activities"] += 1
+            past_id, past_group = next(past_groups, (None, None))
+        compare_stage.items = counts["updated-activities"] + counts["unchanged-activities"]
+    past_records.close()
+    current_records.close()
+    print("{} new activities, {} common activities, {} removed activities".format(
+        counts["new-activities"], counts["updated-activities"] + counts["unchanged-activities"], counts["removed-activities"]))
+
+    with trace_stage("write-xml") as write_stage:
+        write_kept_activities(current_xml_filename, updated_xml_filename, iter(kept_positions))
+        write_stage.items = len(kept_positions)
+    kept_positions.close()
+
+    if manifest_records is not None:
+        manifest_filename = manifest_filename_for(updated_xml_filename)
+        print("Writing fingerprint manifest of '{}' to '{}'... Done.".format(current_xml_filename, manifest_filename))
+        write_streamed_manifest(manifest_filename, ((activity_id, fingerprint) for _, activity_id, fingerprint in manifest_records), ignored_attributes)
+        manifest_records.close()
+    return counts
+
+
+@traced_pipeline
+def xml_differencer(past_xml_filename, current_xml_filename, updated_xml_filename, ignore_datetimes=False, write_manifest=False, write_changeset=False,
+                    memory_budget_mb=None):
     print("Finding updated activities from '{}' to '{}'. Saving as '{}'... Done.".format(past_xml_filename, current_xml_filename, updated_xml_filename))
-    past_xmlfile = open(past_xml_filename, "r")
-    past_tree = etree.parse(past_xmlfile)
-    past_root = past_tree.getroot()
-
-    current_xmlfile = open(current_xml_filename, "r")
-    current_tree = etree.parse(current_xmlfile)
-    current_root = current_tree.getroot()
-
-    past_ids = [iati_id.text for iati_id in past_root.xpath("//iati-identifier")]
-    current_ids = [iati_id.text for iati_id in current_root.xpath("//iati-identifier")]
-    new_ids = [current_id for current_id in current_ids if current_id not in past_ids]
-    removed_ids = [past_id for past_id in past_ids if past_id not in current_ids]
-    common_ids = [past_id for past_id in past_ids if past_id in current_ids]
+    if memory_budget_mb:  # Neither file is held in memory
+        if write_changeset:
+            print("Changed fields can't be compared within a memory budget, so no changeset was written")
+        return external_xml_differencer(past_xml_filename, current_xml_filename, updated_xml_filename, ignore_datetimes, write_manifest, memory_budget_mb)
+    ignored_attributes = DATETIME_ATTRIBUTES if ignore_datetimes else []
+    past_activities = None
+    if os.path.splitext(past_xml_filename)[1].lower() == ".json":  # Fingerprint manifest of a previous diff, no XML to parse
+        with trace_stage("read-manifest") as manifest_stage:
+            past_fingerprints, ignored_attributes = read_fingerprint_manifest(past_xml_filename)
+            manifest_stage.items = len(past_fingerprints)
+    else:
+        with trace_stage("parse") as parse_stage:
+            past_xmlfile = open(past_xml_filename, "r")
+            past_tree = etree.parse(past_xmlfile)
+            past_root = past_tree.getroot()
+            past_activities = index_activities(past_root)
+            parse_stage.items = len(past_activities)
+        with trace_stage("fingerprint") as fingerprint_stage:
+            past_fingerprints = fingerprint_activities(past_activities, ignored_attributes)
+            fingerprint_stage.items = len(past_fingerprints)
+
+    with trace_stage("parse") as parse_stage:
+        current_xmlfile = open(current_xml_filename, "r")
+        current_tree = etree.parse(current_xmlfile)
+        current_root = current_tree.getroot()
+        current_activities = index_activities(current_root)
+        parse_stage.items = len(current_activities)
+
+    with trace_stage("fingerprint") as fingerprint_stage:
+        current_fingerprints = fingerprint_activities(current_activities, ignored_attributes)
+        fingerprint_stage.items = len(current_fingerprints)
+    new_ids = [current_id for current_id in current_fingerprints if current_id not in past_fingerprints]
+    removed_ids = [past_id for past_id in past_fingerprints if past_id not in current_fingerprints]
+    common_ids = [past_id for past_id in past_fingerprints if past_id in current_fingerprints]
     print("{} new activities, {} common activities, {} removed activities".format(len(new_ids), len(common_ids), len(removed_ids)))
-    for common_id in common_ids:
-        past_elem = past_root.xpath("//iati-activity[iati-identifier/text()='{}']".format(common_id))[0]
-        current_elem = current_root.xpath("//iati-activity[iati-identifier/text()='{}']".format(common_id))[0]
-        if elements_equal(past_elem, current_elem):
-            current_elem.getparent().remove(current_elem)
-
-    doc = etree.ElementTree(current_root)
-    with open(updated_xml_filename, "wb") as xmlfile:
-        doc.write(xmlfile, encoding="utf-8", pretty_print=True)
+    unchanged_ids = set()
+    with trace_stage("compare") as compare_stage:
+        for common_id in common_ids:
+            if past_fingerprints[common_id] == current_fingerprints[common_id]:
+                current_elem = current_activities[common_id]
+                current_elem.getparent().remove(current_elem)
+                unchanged_ids.add(common_id)
+        compare_stage.items = len(common_ids)
+    unchanged_count = len(unchanged_ids)
+
+    changed_cell_count = None
+    if write_changeset and past_activities is None:
+        print("A fingerprint manifest holds no values to compare, so no changeset was written")
+    elif write_changeset:
+        changeset_filename = changeset_filename_for(updated_xml_filename)
+        print("Writing changed fields to '{}'... Done.".format(changeset_filename))
+        with trace_stage("changeset") as changeset_stage:  # Unchanged activities can't hold changed fields, so only the rest are melted
+            changeset_df = activity_changeset(
+                OrderedDict((past_id, past_activity) for past_id, past_activity in past_activities.items() if past_id not in unchanged_ids),
+                OrderedDict((current_id, current_activity) for current_id, current_activity in current_activities.items() if current_id not in unchanged_ids),
+                ignored_attributes)
+            changeset_df.to_csv(changeset_filename, index=False)
+            changed_cell_count = changeset_stage.items = len(changeset_df)
+
+    with trace_stage("write-xml") as write_stage:
+        doc = etree.ElementTree(current_root)
+        with open(updated_xml_filename, "wb") as xmlfile:
+            doc.write(xmlfile, encoding="utf-8", pretty_print=True)
+        write_stage.items = len(current_root)
+
+    if write_manifest:
+        manifest_filename = manifest_filename_for(updated_xml_filename)
+        print("Writing fingerprint manifest of '{}' to '{}'... Done.".format(current_xml_filename, manifest_filename))
+        write_fingerprint_manifest(manifest_filename, current_fingerprints, ignored_attributes)
+
+    summary = OrderedDict([("new-activities", len(new_ids)), ("updated-activities", len(common_ids) - unchanged_count), ("unchanged-activities", unchanged_count), ("removed-activities", len(removed_ids))])
+    if changed_cell_count is not None:
+        summary["changed-fields"] = changed_cell_count
+    return summary
 
 
 if __name__ == "__main__":
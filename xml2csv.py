@@ -1,26 +1,26 @@
 import sys
-from utils import xml_to_csv
-from tkinter import Label, Entry, Button, Tk, filedialog, END, Text, W, E, N, S
+import threading
+import importlib
+import multiprocessing
+from gui import JobRunner
+from tkinter import Label, Entry, Button, Checkbutton, IntVar, Tk, filedialog, END, Text, W, E, N, S
 
 
-class StdoutRedirector(object):
-    def __init__(self, text_widget):
-        self.text_space = text_widget
+PRELOAD_DELAY_MS = 200
 
-    def write(self, string):
-        self.text_space.configure(state='normal')
-        self.text_space.insert('end', string)
-        self.text_space.see('end')
-        self.text_space.configure(state='disabled')
 
-    def flush(self):
-        pass
+def preload():
+    # Heavy modules (pandas, lxml, iati) are imported off the main thread once the window is up
+    importlib.import_module("utils")
 
 
 class Window:
     def __init__(self, master):
         self.input = None
         self.output = None
+        self.update = IntVar()
+        self.instrument = IntVar()
+        self.sqlite = IntVar()
         Label(root, text="XML file").grid(row=1, column=0, sticky=W)
         Label(root, text="Output directory (optional)").grid(row=2, column=0, sticky=W)
         self.bari = Entry(master, state='disabled')
@@ -28,6 +28,10 @@ class Window:
         self.baro = Entry(master, state='disabled')
         self.baro.grid(row=2, column=1, sticky=W + E)
 
+        Checkbutton(root, text="Update existing CSVs", variable=self.update).grid(row=3, column=0, sticky=W)
+        Checkbutton(root, text="Show stage timings", variable=self.instrument).grid(row=3, column=1, sticky=W)
+        Checkbutton(root, text="SQLite store", variable=self.sqlite).grid(row=3, column=2, sticky=W)
+
         # Buttons
         self.cbutton = Button(root, text="Generate CSVs", command=self.process)
         self.cbutton.grid(row=3, column=3, sticky=E)
@@ -36,10 +40,12 @@ class Window:
         self.obutton = Button(root, text="Browse", command=self.browseoutput)
         self.obutton.grid(row=2, column=3, sticky=E)
 
+        self.kbutton = Button(root, text="Cancel")
+        self.kbutton.grid(row=4, column=3, sticky=E)
+
         self.text_box = Text(root, wrap='word', height=10, state='disabled')
-        self.text_box.grid(column=0, row=4, padx=5, pady=5, columnspan=4, sticky=W + E + N + S)
-        sys.stdout = StdoutRedirector(self.text_box)
-        sys.stderr = StdoutRedirector(self.text_box)
+        self.text_box.grid(column=0, row=5, padx=5, pady=5, columnspan=4, sticky=W + E + N + S)
+        self.runner = JobRunner(root, self.text_box, self.cbutton, self.kbutton, row=4)
 
     def browseinput(self):
         Tk().withdraw()
@@ -59,7 +65,13 @@ class Window:
 
     def process(self):
         if self.input:
-            xml_to_csv(self.input, self.output)
+            xml_filename, csv_dir = self.input, self.output
+            update, sqlite, instrument = bool(self.update.get()), bool(self.sqlite.get()), bool(self.instrument.get())
+
+            def convert():
+                from utils import xml_to_csv
+                xml_to_csv(xml_filename, csv_dir, update=update, sqlite=sqlite, instrument=instrument)
+            self.runner.start(convert)
         else:
             print("Error: Please select one input XML file.")
 
@@ -69,8 +81,11 @@ def on_closing():
     sys.exit(0)
 
 
-root = Tk()
-root.title("DevInit IATI XML to CSV tool")
-root.protocol("WM_DELETE_WINDOW", on_closing)
-window = Window(root)
-root.mainloop()
+if __name__ == "__main__":
+    multiprocessing.freeze_support()
+    root = Tk()
+    root.title("DevInit IATI XML to CSV tool")
+    root.protocol("WM_DELETE_WINDOW", on_closing)
+    window = Window(root)
+    root.after(PRELOAD_DELAY_MS, lambda: threading.Thread(target=preload, daemon=True).start())
+    root.mainloop()